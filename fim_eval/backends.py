@@ -0,0 +1,255 @@
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, Optional
+
+from fim_eval.load_problems import Problem
+from fim_eval.prompts import construct_prompt
+from fim_eval.sharding import ShardRunner, iter_sharded, modal_runner, run_sharded
+from fim_eval.tracing import merge, span
+
+
+@dataclass
+class SamplingConfig:
+    samples_per_prompt: int = 1
+    temperature: float = 0.1
+    top_p: float = 0.95
+    max_tokens: int = 512
+    # See fim_eval.profiles for how these are chosen per benchmark.
+    stop: tuple[str, ...] = ()
+    include_stop_str_in_output: bool = False
+    stop_at_suffix: bool = False
+
+
+@dataclass
+class Generation:
+    # completions[i] holds the samples for prompts[i].
+    completions: list[list[str]]
+    # Seconds spent per phase, e.g. {"generate_seconds": 35.2}.
+    timings: dict[str, float] = field(default_factory=dict)
+
+
+class GenerationBackend:
+    """Turns prompts and a SamplingConfig into completions plus timings."""
+
+    name: str
+
+    def generate(self, prompts: list[str], config: SamplingConfig) -> Generation:
+        raise NotImplementedError
+
+    def generate_batches(
+        self, prompts: list[str], config: SamplingConfig, batch_size: int
+    ) -> Iterator[tuple[list[int], list[list[str]]]]:
+        """
+        Yields (prompt indices, completions) for batches of at most
+        `batch_size` prompts as they finish, so consumers can start on early
+        batches while later ones generate. By default they run one after
+        another; backends that shard over containers run up to `num_shards`
+        batches at a time.
+        """
+        for indices in batch_indices(len(prompts), batch_size):
+            prompt_batch = [prompts[i] for i in indices]
+            yield indices, self.generate(prompt_batch, config).completions
+
+
+def batch_indices(num_prompts: int, batch_size: int) -> list[list[int]]:
+    return [
+        list(range(start, min(start + batch_size, num_prompts)))
+        for start in range(0, num_prompts, batch_size)
+    ]
+
+
+BACKENDS: dict[str, Callable[..., GenerationBackend]] = {}
+
+
+def register_backend(name: str):
+    def register(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+
+    return register
+
+
+def get_backend(name: str, **kwargs) -> GenerationBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {list(BACKENDS)}")
+    return BACKENDS[name](**kwargs)
+
+
+class ModalFunctionBackend(GenerationBackend):
+    """
+    Generates with a Modal GPU function. With `num_shards` > 1 the prompts are
+    split into shards that run in parallel containers.
+    """
+
+    def __init__(self, model_name: str, num_shards: int = 1):
+        self.model_name = model_name
+        self.num_shards = num_shards
+
+    def function(self):
+        raise NotImplementedError
+
+    def generate(self, prompts: list[str], config: SamplingConfig) -> Generation:
+        function = self.function()
+        kwargs = sampling_kwargs(config)
+
+        with span("remote_generation", backend=self.name, prompts=len(prompts)) as s:
+            if self.num_shards > 1:
+                completions = run_sharded(
+                    prompts,
+                    self.num_shards,
+                    modal_runner(function, self.model_name, **kwargs),
+                )
+            else:
+                response = function.remote(self.model_name, prompts, **kwargs)
+                merge(response["trace"])
+                completions = response["completions"]
+        return Generation(completions, {"generate_seconds": s.seconds})
+
+    def generate_batches(
+        self, prompts: list[str], config: SamplingConfig, batch_size: int
+    ) -> Iterator[tuple[list[int], list[list[str]]]]:
+        # Each batch is a shard in its own container, at most `num_shards` at a
+        # time, and a failed one is retried.
+        yield from iter_sharded(
+            prompts,
+            self.num_shards,
+            modal_runner(self.function(), self.model_name, **sampling_kwargs(config)),
+            shard_size=batch_size,
+        )
+
+
+def sampling_kwargs(config: SamplingConfig) -> dict:
+    """The keyword arguments the Modal generation functions take."""
+    return dict(
+        samples_per_prompt=config.samples_per_prompt,
+        temperature=config.temperature,
+        top_p=config.top_p,
+        max_tokens=config.max_tokens,
+        stop=config.stop,
+        include_stop_str_in_output=config.include_stop_str_in_output,
+        stop_at_suffix=config.stop_at_suffix,
+    )
+
+
+@register_backend("vllm")
+class VllmBackend(ModalFunctionBackend):
+    def function(self):
+        # Imported here so selecting another backend does not need the vllm
+        # Modal function.
+        from fim_eval.run_with_vllm import run_with_vllm
+
+        return run_with_vllm
+
+
+@register_backend("transformers")
+class TransformersBackend(ModalFunctionBackend):
+    def function(self):
+        from fim_eval.run_with_transformers import run_with_transformers
+
+        return run_with_transformers
+
+
+@register_backend("vllm-server")
+class VllmServerBackend(GenerationBackend):
+    """
+    Generates with the long-lived ModelServer, which keeps the model loaded
+    between calls. With `num_shards` > 1 the prompts go out as concurrent
+    requests that the server batches together or spreads over containers.
+    """
+
+    def __init__(self, model_name: str, num_shards: int = 1):
+        self.model_name = model_name
+        self.num_shards = num_shards
+
+    def generate(self, prompts: list[str], config: SamplingConfig) -> Generation:
+        server_timings: list[dict[str, float]] = []
+        run = self.runner(config, server_timings)
+        with span("remote_generation", backend=self.name, prompts=len(prompts)) as s:
+            completions = run_sharded(prompts, self.num_shards, run)
+        timings = {"generate_seconds": s.seconds}
+        if server_timings:
+            # Paid once per container start, not by this call unless it was cold.
+            timings["server_load_seconds"] = max(
+                t["load_seconds"] for t in server_timings
+            )
+            timings["request_seconds"] = max(
+                t["request_seconds"] for t in server_timings
+            )
+        return Generation(completions, timings)
+
+    def generate_batches(
+        self, prompts: list[str], config: SamplingConfig, batch_size: int
+    ) -> Iterator[tuple[list[int], list[list[str]]]]:
+        # At most `num_shards` requests in flight, each retried on failure.
+        yield from iter_sharded(
+            prompts, self.num_shards, self.runner(config, []), shard_size=batch_size
+        )
+
+    def runner(self, config: SamplingConfig, server_timings: list[dict]) -> ShardRunner:
+        """Sends a shard as one request, collecting the server's timings."""
+        from fim_eval.model_server import ModelServer
+
+        server = ModelServer(model_name=self.model_name)
+        kwargs = sampling_kwargs(config)
+
+        def run(shard: list[str]) -> list[list[str]]:
+            response = server.generate.remote(shard, **kwargs)
+            merge(response["trace"])
+            server_timings.append(response["timings"])
+            return response["completions"]
+
+        return run
+
+
+@register_backend("fake")
+class FakeBackend(GenerationBackend):
+    """
+    Deterministic offline backend for exercising the pipeline without a GPU.
+
+    Each prompt is answered with its canned completion from `completions`,
+    else the canonical solution of the problem in `problems` it was built
+    from, else an empty string. `load_seconds` and `seconds_per_prompt` add
+    simulated model load and generation latency. With `num_shards` > 1 the
+    prompts are sharded across local threads, standing in for containers.
+    """
+
+    def __init__(
+        self,
+        problems: Iterable[Problem] = (),
+        completions: Optional[dict[str, str]] = None,
+        load_seconds: float = 0.0,
+        seconds_per_prompt: float = 0.0,
+        num_shards: int = 1,
+    ):
+        self.by_prompt = {
+            construct_prompt(problem): problem.canonical_solution
+            for problem in problems
+        }
+        self.by_prompt.update(completions or {})
+        self.load_seconds = load_seconds
+        self.seconds_per_prompt = seconds_per_prompt
+        self.num_shards = num_shards
+
+    def complete(self, prompts: list[str], samples_per_prompt: int) -> list[list[str]]:
+        time.sleep(self.seconds_per_prompt * len(prompts))
+        return [
+            [self.by_prompt.get(prompt, "")] * samples_per_prompt for prompt in prompts
+        ]
+
+    def generate(self, prompts: list[str], config: SamplingConfig) -> Generation:
+        with span("model_load", backend=self.name) as load:
+            time.sleep(self.load_seconds)
+        with span("generation", backend=self.name, prompts=len(prompts)) as generation:
+            if self.num_shards > 1:
+                completions = run_sharded(
+                    prompts,
+                    self.num_shards,
+                    lambda shard: self.complete(shard, config.samples_per_prompt),
+                )
+            else:
+                completions = self.complete(prompts, config.samples_per_prompt)
+        return Generation(
+            completions,
+            {"load_seconds": load.seconds, "generate_seconds": generation.seconds},
+        )
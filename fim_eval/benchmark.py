@@ -0,0 +1,491 @@
+"""
+Reproducible benchmarks for the evaluation side of the pipeline, runnable
+offline on a CPU-only box:
+
+    python -m fim_eval.benchmark --out bench.json
+    python -m fim_eval.benchmark --compare benchmarks/baseline.json
+
+Every benchmark runs on a synthetic dataset generated from a fixed seed, so
+no download is needed and two runs measure the same work. Each measurement
+is repeated and reported as the median (and min) seconds, with the number of
+items it processed, as JSON. `--compare` flags any measurement whose median
+is more than `--threshold` slower than the baseline's and exits non-zero.
+Timings only compare on the same machine; the metadata records which one.
+"""
+
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, NamedTuple, Optional
+
+DEFAULT_REPEATS = 5
+DEFAULT_THRESHOLD = 0.25
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+
+# Workload sizes, and the smaller ones used by --quick.
+SIZES = {
+    "problems": 200,
+    "large_problems": 5000,
+    "samples_per_problem": 5,
+    "spawned_checks": 20,
+    "pass_at_k_problems": 10_000,
+    "pass_at_k_samples": 20,
+    "results": 50_000,
+    "pipeline_problems": 100,
+}
+QUICK_SIZES = {
+    "problems": 20,
+    "large_problems": 500,
+    "samples_per_problem": 2,
+    "spawned_checks": 4,
+    "pass_at_k_problems": 1000,
+    "pass_at_k_samples": 10,
+    "results": 5000,
+    "pipeline_problems": 10,
+}
+CONCURRENCY_LEVELS = [1, 2, 4, 8]
+PASS_AT_K = [1, 5, 10]
+CHECK_TIMEOUT = 10.0
+
+
+class Measurement(NamedTuple):
+    name: str
+    runs: list[float]
+    items: int
+    unit: str
+
+    @property
+    def seconds(self) -> float:
+        return statistics.median(self.runs)
+
+    def to_json(self) -> dict:
+        return {
+            "seconds": self.seconds,
+            "min_seconds": min(self.runs),
+            "runs": self.runs,
+            "items": self.items,
+            "unit": self.unit,
+            "per_second": self.items / self.seconds if self.seconds else None,
+        }
+
+
+class Env(NamedTuple):
+    workdir: str
+    sizes: dict[str, int]
+    repeats: int
+
+
+def measure(
+    name: str,
+    fn: Callable[[], object],
+    items: int,
+    unit: str,
+    repeats: int,
+    setup: Optional[Callable[[], object]] = None,
+) -> Measurement:
+    """Times `fn` `repeats` times, running `setup` untimed before each."""
+    runs = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - t0)
+    print(f"{name}: {statistics.median(runs):.4f}s ({items} {unit})", file=sys.stderr)
+    return Measurement(name, runs, items, unit)
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            yield
+
+
+def synthetic_problem(i: int) -> dict:
+    """A small infilling problem; holes cut from the same function share a stratum."""
+    factor = i % 7
+    return {
+        "task_id": f"Bench/{i // 4}/L{i % 4}",
+        "prompt": f"def f_{i}(xs):\n    total = 0\n    for x in xs:\n",
+        "suffix": "    return total\n",
+        "canonical_solution": f"        total += x * {factor}\n",
+        "test": (
+            "def check(candidate):\n"
+            f"    assert candidate([1, 2, 3]) == {6 * factor}\n"
+            "    assert candidate([]) == 0\n"
+        ),
+        "entry_point": f"f_{i}",
+    }
+
+
+def write_dataset(path: str, num_problems: int) -> str:
+    with gzip.open(path, "wt") as f:
+        for i in range(num_problems):
+            f.write(json.dumps(synthetic_problem(i)) + "\n")
+    return path
+
+
+def synthetic_completions(problem: dict, samples: int, rng: random.Random) -> list[str]:
+    """A fixed mix of passing, failing and crashing completions."""
+    choices = [
+        problem["canonical_solution"],
+        "        total += x + 1\n",
+        "        total += undefined_name\n",
+    ]
+    return [rng.choice(choices) for _ in range(samples)]
+
+
+def bench_execution(env: Env) -> list[Measurement]:
+    from fim_eval.execution import ExecutionPool, check_correctness
+
+    problems = [synthetic_problem(i) for i in range(env.sizes["problems"])]
+    rng = random.Random(0)
+    jobs = [
+        (problem, completion)
+        for problem in problems
+        for completion in synthetic_completions(
+            problem, env.sizes["samples_per_problem"], rng
+        )
+    ]
+    measurements = []
+    for workers in CONCURRENCY_LEVELS:
+        with ExecutionPool(workers) as pool:
+
+            def run():
+                futures = [pool.submit(p, c, CHECK_TIMEOUT) for p, c in jobs]
+                for future in futures:
+                    future.result()
+
+            # One untimed pass so every worker has started and warmed up.
+            run()
+            measurements.append(
+                measure(
+                    f"execution/pool/{workers}", run, len(jobs), "checks", env.repeats
+                )
+            )
+
+    spawned = jobs[: env.sizes["spawned_checks"]]
+    measurements.append(
+        measure(
+            "execution/spawn",
+            lambda: [check_correctness(p, c, CHECK_TIMEOUT) for p, c in spawned],
+            len(spawned),
+            "checks",
+            env.repeats,
+        )
+    )
+    return measurements
+
+
+def bench_load(env: Env) -> list[Measurement]:
+    from fim_eval.load_problems import Problem
+    from fim_eval.problem_cache import (
+        build_cache,
+        cache_path,
+        open_problems,
+        source_stamp,
+    )
+
+    num_problems = env.sizes["large_problems"]
+    path = write_dataset(os.path.join(env.workdir, "load.jsonl.gz"), num_problems)
+
+    def parse():
+        with gzip.open(path, "rt") as f:
+            return [Problem(**json.loads(line)) for line in f]
+
+    def open_and_read():
+        for problem in open_problems(path):
+            problem.task_id
+            problem.prompt
+
+    return [
+        measure("load/parse", parse, num_problems, "problems", env.repeats),
+        measure(
+            "load/build_cache",
+            lambda: build_cache(path, cache_path(path), source_stamp(path)),
+            num_problems,
+            "problems",
+            env.repeats,
+        ),
+        measure(
+            "load/open_cache", open_and_read, num_problems, "problems", env.repeats
+        ),
+    ]
+
+
+def bench_pass_at_k(env: Env) -> list[Measurement]:
+    import numpy as np
+
+    from fim_eval.pass_at_k import pass_at_k, summarize_pass_at_k
+
+    num_problems = env.sizes["pass_at_k_problems"]
+    samples = env.sizes["pass_at_k_samples"]
+    num_correct = np.random.default_rng(0).integers(0, samples + 1, num_problems)
+    ks = [k for k in PASS_AT_K if k <= samples]
+    return [
+        measure(
+            "pass_at_k/estimate",
+            lambda: pass_at_k(samples, num_correct, ks),
+            num_problems,
+            "problems",
+            env.repeats,
+        ),
+        measure(
+            "pass_at_k/summarize",
+            lambda: summarize_pass_at_k(samples, num_correct, ks),
+            num_problems,
+            "problems",
+            env.repeats,
+        ),
+    ]
+
+
+def bench_results(env: Env) -> list[Measurement]:
+    from fim_eval.evaluate_fim_results import iter_samples
+    from fim_eval.pipeline import write_results
+    from fim_eval.records import ResultRecord, pack_results, unpack_results
+
+    count = env.sizes["results"]
+    rng = random.Random(0)
+    results = [
+        ResultRecord(
+            f"Bench/{i // 20}/L{i // 5 % 4}",
+            synthetic_completions(synthetic_problem(i // 5), 1, rng)[0],
+            i % 5,
+        )
+        for i in range(count)
+    ]
+    path = os.path.join(env.workdir, "results.jsonl")
+    write_results(results, path)
+    packed = pack_results(results)
+    return [
+        measure(
+            "results/write_jsonl",
+            lambda: write_results(results, path),
+            count,
+            "results",
+            env.repeats,
+        ),
+        measure(
+            "results/read_jsonl",
+            lambda: list(iter_samples(path)),
+            count,
+            "results",
+            env.repeats,
+        ),
+        measure(
+            "results/pack", lambda: pack_results(results), count, "results", env.repeats
+        ),
+        measure(
+            "results/unpack",
+            lambda: unpack_results(packed),
+            count,
+            "results",
+            env.repeats,
+        ),
+    ]
+
+
+def bench_pipeline(env: Env) -> list[Measurement]:
+    from fim_eval.backends import get_backend
+    from fim_eval.pipeline import run_pipeline
+    from fim_eval.problem_cache import open_problems
+    from fim_eval.profiles import get_profile, sampling_config
+
+    num_problems = env.sizes["pipeline_problems"]
+    dataset_path = write_dataset(
+        os.path.join(env.workdir, "pipeline.jsonl.gz"), num_problems
+    )
+    problems = list(open_problems(dataset_path))
+    backend = get_backend("fake", problems=problems)
+    profile = get_profile("single-line")
+    config = sampling_config(
+        profile, problems, samples_per_prompt=env.sizes["samples_per_problem"]
+    )
+    cache_path = os.path.join(env.workdir, "verdict_cache.sqlite")
+
+    def fresh_cache():
+        # Cached verdicts would skip the execution the pipeline is timed on.
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(cache_path + suffix):
+                os.remove(cache_path + suffix)
+
+    def run():
+        with quiet():
+            run_pipeline(
+                backend,
+                config,
+                problems,
+                os.path.join(env.workdir, "pipeline_results.jsonl"),
+                profile,
+                dataset_path=dataset_path,
+                verdict_cache_path=cache_path,
+            )
+
+    # Calibrates the timeouts once, outside the timed runs.
+    fresh_cache()
+    run()
+    return [
+        measure(
+            "pipeline/fake",
+            run,
+            num_problems * config.samples_per_prompt,
+            "samples",
+            env.repeats,
+            setup=fresh_cache,
+        )
+    ]
+
+
+# Commands timed from process start to exit, bare Python for reference.
+STARTUP_COMMANDS = {
+    "startup/python": ["-c", "pass"],
+    "startup/cli_help": ["-m", "fim_eval.cli", "--help"],
+    "startup/import_evaluator": ["-c", "import fim_eval.evaluate_fim_results"],
+    "startup/import_pipeline": ["-c", "import fim_eval.pipeline"],
+}
+
+
+def bench_startup(env: Env) -> list[Measurement]:
+    pythonpath = os.pathsep.join(filter(None, [REPO_DIR, os.environ.get("PYTHONPATH")]))
+    process_env = {**os.environ, "PYTHONPATH": pythonpath}
+
+    def start(args: list[str]):
+        subprocess.run(
+            [sys.executable, *args],
+            env=process_env,
+            cwd=env.workdir,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+
+    measurements = []
+    for name, args in STARTUP_COMMANDS.items():
+        # Untimed first start so the timed ones read compiled bytecode.
+        start(args)
+        measurements.append(
+            measure(name, lambda: start(args), 1, "starts", env.repeats)
+        )
+    return measurements
+
+
+SUITES: dict[str, Callable[[Env], list[Measurement]]] = {
+    "startup": bench_startup,
+    "execution": bench_execution,
+    "load": bench_load,
+    "pass_at_k": bench_pass_at_k,
+    "results": bench_results,
+    "pipeline": bench_pipeline,
+}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def machine() -> dict:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def run_benchmarks(
+    suites: list[str], repeats: int = DEFAULT_REPEATS, quick: bool = False
+) -> dict:
+    sizes = QUICK_SIZES if quick else SIZES
+    results: dict[str, dict] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        env = Env(workdir, sizes, repeats)
+        for suite in suites:
+            for measurement in SUITES[suite](env):
+                results[measurement.name] = measurement.to_json()
+    return {
+        "meta": {
+            "machine": machine(),
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "repeats": repeats,
+            "quick": quick,
+            "sizes": sizes,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints current vs baseline medians and returns the regressed names."""
+    if current["meta"]["machine"] != baseline["meta"]["machine"]:
+        print("Warning: the baseline was recorded on a different machine")
+    if current["meta"]["sizes"] != baseline["meta"]["sizes"]:
+        print("Warning: the baseline was recorded with different workload sizes")
+
+    regressions = []
+    print(f"{'benchmark':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            print(f"{name:<24} {'-':>10} {result['seconds']:>9.4f}s {'new':>8}")
+            continue
+        before = baseline["results"][name]["seconds"]
+        ratio = result["seconds"] / before if before else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(
+            f"{name:<24} {before:>9.4f}s {result['seconds']:>9.4f}s "
+            f"{ratio - 1:>+7.1%}{flag}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--suite", nargs="+", choices=list(SUITES), default=list(SUITES)
+    )
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS)
+    parser.add_argument("--quick", action="store_true", help="smaller workloads")
+    parser.add_argument("--out", default=None, help="write the results JSON here")
+    parser.add_argument(
+        "--compare", default=None, help=f"baseline JSON, e.g. {BASELINE_PATH}"
+    )
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.suite, args.repeats, args.quick)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressed past {args.threshold:.0%}")
+            sys.exit(1)
@@ -0,0 +1,131 @@
+"""
+Command line entry point for evaluating, scoring and reporting on results:
+
+    python -m fim_eval.cli evaluate [--dataset multi-line] [--follow]
+        [--tasks ID ...] [--prefix P] [--sample N --seed S]
+    python -m fim_eval.cli score [--results data/results.jsonl]
+    python -m fim_eval.cli report [--top 10] [--failures 5]
+
+Only argparse and the dataset registry are imported up front. Each command
+imports what it needs when it runs, so `score` and `report`, which only read
+the verdicts file, start quickly, and nothing here touches Modal.
+"""
+
+import argparse
+import os
+import sys
+from typing import Optional
+
+from fim_eval.datasets import DATASETS, DEFAULT_DATASET, Subset
+
+DEFAULT_RESULTS = os.path.join("data", "results.jsonl")
+
+
+def evaluate(args: argparse.Namespace):
+    from fim_eval import evaluate_fim_results as evaluation
+    from fim_eval.execution import ExecutionPool
+    from fim_eval.timeouts import load_timeouts
+    from fim_eval.tracing import TRACER, enable, span
+    from fim_eval.verdict_cache import VerdictCache
+
+    if args.trace:
+        enable()
+    evaluation.download_eval(args.dataset)
+    # Timeouts are only calibrated for the problems being evaluated.
+    problems = evaluation.load_eval(args.dataset, subset(args))
+    problem_by_id = {problem.task_id: problem for problem in problems}
+
+    with (
+        span("evaluation"),
+        ExecutionPool(
+            evaluation.MAX_WORKERS, evaluation.MAX_JOBS_PER_WORKER, evaluation.LIMITS
+        ) as pool,
+        VerdictCache() as cache,
+    ):
+        timeouts = load_timeouts(evaluation.dataset_file(args.dataset), problems, pool)
+        evaluation.evaluate_results(
+            args.results, problem_by_id, pool, timeouts, cache, follow=args.follow
+        )
+
+    with span("aggregation"):
+        evaluation.score_results(evaluation.verdicts_path(args.results))
+    evaluation.print_resource_report(evaluation.verdicts_path(args.results))
+    if args.trace:
+        TRACER.write(args.trace)
+        print(f"Wrote trace to {args.trace}")
+
+
+def score(args: argparse.Namespace):
+    from fim_eval.evaluate_fim_results import score_results, verdicts_path
+
+    if not score_results(verdicts_path(args.results)):
+        sys.exit(1)
+
+
+def report(args: argparse.Namespace):
+    from fim_eval import evaluate_fim_results as evaluation
+
+    evaluation.print_resource_report(
+        evaluation.verdicts_path(args.results), top=args.top
+    )
+    if args.failures:
+        problems = evaluation.load_eval(args.dataset)
+        problem_by_id = {problem.task_id: problem for problem in problems}
+        evaluation.print_failures(args.results, problem_by_id, args.failures)
+
+
+def subset(args: argparse.Namespace) -> Subset:
+    return Subset(
+        tuple(args.tasks) if args.tasks else None, args.prefix, args.sample, args.seed
+    )
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m fim_eval.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_command(name: str, run, help: str) -> argparse.ArgumentParser:
+        command = commands.add_parser(name, help=help)
+        command.set_defaults(run=run)
+        command.add_argument("--results", default=DEFAULT_RESULTS)
+        return command
+
+    command = add_command(
+        "evaluate", evaluate, "execute a results file and score its verdicts"
+    )
+    command.add_argument("--dataset", choices=list(DATASETS), default=DEFAULT_DATASET)
+    command.add_argument(
+        "--follow", action="store_true", help="keep evaluating lines as they are added"
+    )
+    command.add_argument(
+        "--trace", default=None, help="write a Chrome/Perfetto trace of the run here"
+    )
+    command.add_argument("--tasks", nargs="+", default=None, help="only these task ids")
+    command.add_argument(
+        "--prefix", default=None, help="only task ids starting with this"
+    )
+    command.add_argument(
+        "--sample", type=int, default=None, help="a stratified sample of this many"
+    )
+    command.add_argument("--seed", type=int, default=0)
+
+    add_command("score", score, "accuracy and pass@k from the verdicts file")
+
+    command = add_command(
+        "report", report, "the most expensive problems and completions"
+    )
+    command.add_argument("--top", type=int, default=10)
+    command.add_argument(
+        "--failures", type=int, default=0, help="also print this many failed samples"
+    )
+    command.add_argument("--dataset", choices=list(DATASETS), default=DEFAULT_DATASET)
+    return parser
+
+
+def main(argv: Optional[list[str]] = None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
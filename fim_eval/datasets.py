@@ -0,0 +1,138 @@
+"""
+The infilling benchmarks we evaluate on, and subsets of them.
+
+A Subset narrows a dataset by task_id list, task_id prefix and/or a seeded
+stratified sample. Selection only reads the task_id column of the problem
+cache, so a 10-problem smoke run never decodes the rest of the dataset, and
+a full run is just the empty Subset going through the same code.
+
+Sampling is stratified by source problem: the task ids of every variant look
+like `SingleLineInfilling/HumanEval/12/L3`, and all holes cut from
+HumanEval/12 share a stratum. Strata are represented in proportion to their
+size, so a small sample spreads over as many source problems as it can.
+"""
+
+import random
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import NamedTuple, Optional
+
+from fim_eval.fetch import (
+    HUMANEVAL_MULTI_LINE,
+    HUMANEVAL_RANDOM_SPAN,
+    HUMANEVAL_SINGLE_LINE,
+    DatasetSource,
+    fetch_all,
+)
+from fim_eval.problem_cache import LazyProblem, ProblemTable, open_problems
+from fim_eval.tracing import span
+
+
+class Dataset(NamedTuple):
+    name: str
+    source: DatasetSource
+    # The fim_eval.profiles profile completions are generated and trimmed with.
+    profile: str
+
+
+DATASETS = {
+    dataset.name: dataset
+    for dataset in (
+        Dataset("single-line", HUMANEVAL_SINGLE_LINE, "single-line"),
+        Dataset("multi-line", HUMANEVAL_MULTI_LINE, "multi-line"),
+        Dataset("random-span", HUMANEVAL_RANDOM_SPAN, "random-span"),
+    )
+}
+DEFAULT_DATASET = "single-line"
+
+
+@dataclass(frozen=True)
+class Subset:
+    # Only these task ids, in dataset order.
+    task_ids: Optional[tuple[str, ...]] = None
+    # Only task ids starting with this.
+    prefix: Optional[str] = None
+    # A stratified random sample of this many of the remaining problems.
+    size: Optional[int] = None
+    seed: int = 0
+
+
+def get_dataset(name: str) -> Dataset:
+    if name not in DATASETS:
+        raise ValueError(f"Unknown dataset {name!r}, expected one of {list(DATASETS)}")
+    return DATASETS[name]
+
+
+def dataset_path(name: str, data_dir: str) -> str:
+    return f"{data_dir}/{get_dataset(name).source.name}"
+
+
+def download_datasets(names: list[str], data_dir: str, **kwargs) -> list[str]:
+    return fetch_all([get_dataset(name).source for name in names], data_dir, **kwargs)
+
+
+def stratum(task_id: str) -> str:
+    """SingleLineInfilling/HumanEval/12/L3 -> SingleLineInfilling/HumanEval/12"""
+    return task_id.rpartition("/")[0]
+
+
+def stratified_sample(task_ids: dict[int, str], size: int, seed: int) -> list[int]:
+    """
+    `size` of the rows in `task_ids` (row -> task_id), allocated to strata in
+    proportion to their size by largest remainder, with ties broken at random.
+    """
+    if size >= len(task_ids):
+        return sorted(task_ids)
+    rng = random.Random(seed)
+    strata: dict[str, list[int]] = defaultdict(list)
+    for row, task_id in task_ids.items():
+        strata[stratum(task_id)].append(row)
+
+    names = sorted(strata)
+    rng.shuffle(names)
+    quotas = {name: size * len(strata[name]) / len(task_ids) for name in names}
+    counts = {name: int(quota) for name, quota in quotas.items()}
+    by_remainder = sorted(names, key=lambda name: counts[name] - quotas[name])
+    for name in by_remainder[: size - sum(counts.values())]:
+        counts[name] += 1
+
+    return sorted(
+        row for name in names for row in rng.sample(strata[name], counts[name])
+    )
+
+
+def select_rows(table: ProblemTable, subset: Subset) -> list[int]:
+    if subset.task_ids is not None:
+        rows = []
+        for task_id in subset.task_ids:
+            row = table.row_of(task_id)
+            if row is None:
+                raise KeyError(f"No task {task_id!r} in the dataset")
+            rows.append(row)
+        rows = sorted(set(rows))
+    else:
+        rows = range(len(table))
+
+    task_ids = {row: table.field(row, "task_id") for row in rows}
+    if subset.prefix is not None:
+        task_ids = {
+            row: task_id
+            for row, task_id in task_ids.items()
+            if task_id.startswith(subset.prefix)
+        }
+    if subset.size is not None:
+        return stratified_sample(task_ids, subset.size, subset.seed)
+    return sorted(task_ids)
+
+
+def load_dataset(
+    name: str = DEFAULT_DATASET, data_dir: str = "data", subset: Subset = Subset()
+) -> list[LazyProblem]:
+    with span("dataset_load", dataset=name) as s:
+        table = open_problems(dataset_path(name, data_dir))
+        if subset == Subset():
+            problems = list(table)
+        else:
+            problems = [table[row] for row in select_rows(table, subset)]
+        s.args["problems"] = len(problems)
+    return problems
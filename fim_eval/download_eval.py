@@ -4,33 +4,35 @@ import modal
 
 from fim_eval.app import app
 from fim_eval.constants import DATA_DIR, EVAL_VOLUME
+from fim_eval.datasets import DATASETS, download_datasets, dataset_path
+from fim_eval.problem_cache import cache_path, open_problems
 
 vol = modal.Volume.from_name(EVAL_VOLUME, create_if_missing=True)
 
 image = modal.Image.debian_slim().pip_install("requests", "pydantic")
 
-with image.imports():
-    import requests
+# Dataset blobs and their pins are kept on the volume with the datasets.
+CACHE_DIR = os.path.join(DATA_DIR, ".cache")
 
 
-@app.function(volumes={DATA_DIR: vol}, image=image)
-def download_eval():
-    url = "https://raw.githubusercontent.com/openai/human-eval-infilling/88062ff9859c875d04db115b698ed4b0f0395170/data/HumanEval-SingleLineInfilling.jsonl.gz"
-    remote_path = "HumanEval-SingleLineInfilling.jsonl.gz"
-
-    full_path = os.path.join("/data", remote_path)
-
-    # Check if file exists using regular file operations
-    if os.path.exists(full_path):
-        print(f"File {remote_path} already exists in volume")
-        return
+def dataset_state(path: str):
+    if not os.path.exists(path):
+        return None
+    return os.stat(path).st_ino, os.path.exists(cache_path(path))
 
-    print(f"Downloading {url} to volume...")
-    response = requests.get(url)
-    response.raise_for_status()
 
-    with open(full_path, "wb") as f:
-        f.write(response.content)
-    print("Download complete")
-
-    vol.commit()
+@app.function(volumes={DATA_DIR: vol}, image=image)
+def download_eval():
+    paths = [dataset_path(name, DATA_DIR) for name in DATASETS]
+    before = [dataset_state(path) for path in paths]
+
+    download_datasets(list(DATASETS), DATA_DIR, cache_dir=CACHE_DIR)
+    # Built once here so containers loading the problems just map the caches.
+    for path in paths:
+        open_problems(path)
+
+    after = [dataset_state(path) for path in paths]
+    for path, old, new in zip(paths, before, after):
+        print(f"Updated {path}" if old != new else f"{path} is up to date")
+    if after != before:
+        vol.commit()
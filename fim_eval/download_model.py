@@ -1,10 +1,38 @@
+"""
+Keeps model weights on the volume in sync with their source.
+
+Each synced model directory holds a manifest of the revision it came from and
+the size and digest of every file. When the source still reports that revision
+and the files are on disk at their recorded sizes, the sync is a no-op that
+costs one metadata lookup instead of re-verifying multi-GB checkpoints.
+Otherwise only the files that are missing or changed are fetched, and the
+volume is committed only when something changed.
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
 import modal
 from fim_eval.app import app
 from fim_eval.constants import MODEL_VOLUME, MODELS_DIR
-import time
+from fim_eval.tracing import span
 
 DOWNLOAD_TIMEOUT = 4 * 60 * 60  # 4 hours (in seconds)
 
+MANIFEST_NAME = ".fim_manifest.json"
+# Config, tokenizer and code files. Weights are chosen by WEIGHT_FORMATS.
+ALLOW_PATTERNS = ["*.json", "*.py", "*.txt", "*.model", "*.tiktoken"]
+# In order of preference: only the first format a model ships is fetched, so
+# e.g. pickled .bin duplicates of safetensors checkpoints are skipped.
+WEIGHT_FORMATS = [["*.safetensors"], ["*.bin"]]
+
 
 volume = modal.Volume.from_name(MODEL_VOLUME, create_if_missing=True)
 
@@ -20,7 +48,192 @@ download_image = (
 )
 
 with download_image.imports():
-    from huggingface_hub import snapshot_download
+    from huggingface_hub import HfApi, snapshot_download
+
+
+class RemoteFile(NamedTuple):
+    path: str
+    size: int
+    # Content digest: sha256 where the source knows it, else an opaque id
+    # (e.g. the git blob id of a small file on the hub).
+    digest: str
+
+
+class HubSource:
+    """Models on the Hugging Face Hub."""
+
+    def revision(self, model_name: str) -> str:
+        return HfApi().model_info(model_name).sha
+
+    def list_files(self, model_name: str, revision: str) -> list[RemoteFile]:
+        info = HfApi().model_info(model_name, revision=revision, files_metadata=True)
+        return [
+            RemoteFile(
+                sibling.rfilename,
+                sibling.size or 0,
+                sibling.lfs.sha256 if sibling.lfs else sibling.blob_id,
+            )
+            for sibling in info.siblings
+        ]
+
+    def fetch(self, model_name: str, revision: str, paths: list[str], local_dir: str):
+        snapshot_download(
+            model_name, revision=revision, allow_patterns=paths, local_dir=local_dir
+        )
+
+
+class LocalDirSource:
+    """
+    Models laid out as `root/<model_name>/...`, standing in for the hub when
+    exercising the sync without network access. The revision is a digest of
+    the file listing, so editing any file yields a new revision.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def revision(self, model_name: str) -> str:
+        listing = json.dumps(self.list_files(model_name, None), sort_keys=True)
+        return hashlib.sha256(listing.encode()).hexdigest()
+
+    def list_files(self, model_name: str, revision: Optional[str]) -> list[RemoteFile]:
+        model_dir = os.path.join(self.root, model_name)
+        files = []
+        for dirpath, _, filenames in os.walk(model_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                files.append(
+                    RemoteFile(
+                        os.path.relpath(path, model_dir),
+                        os.path.getsize(path),
+                        file_sha256(path),
+                    )
+                )
+        return sorted(files)
+
+    def fetch(self, model_name: str, revision: str, paths: list[str], local_dir: str):
+        for path in paths:
+            target = os.path.join(local_dir, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(os.path.join(self.root, model_name, path), target)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def select_files(
+    files: list[RemoteFile], allow_patterns: list[str] = ALLOW_PATTERNS
+) -> list[RemoteFile]:
+    """The files worth fetching: `allow_patterns` plus one weight format."""
+
+    def matches(file: RemoteFile, patterns: list[str]) -> bool:
+        return any(fnmatch.fnmatch(file.path, pattern) for pattern in patterns)
+
+    for weight_patterns in WEIGHT_FORMATS:
+        if any(matches(file, weight_patterns) for file in files):
+            break
+    else:
+        weight_patterns = []
+    return [file for file in files if matches(file, allow_patterns + weight_patterns)]
+
+
+def read_manifest(local_dir: str) -> dict:
+    try:
+        with open(os.path.join(local_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"revision": None, "files": {}}
+
+
+def model_revision(model_name: str, models_dir: str = MODELS_DIR) -> Optional[str]:
+    """The revision last synced to `models_dir`, or None if it never was."""
+    return read_manifest(os.path.join(models_dir, model_name))["revision"]
+
+
+def write_manifest(local_dir: str, revision: str, files: list[RemoteFile]):
+    manifest = {
+        "revision": revision,
+        "files": {
+            file.path: {"size": file.size, "digest": file.digest} for file in files
+        },
+    }
+    path = os.path.join(local_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def on_disk(local_dir: str, path: str, size: int) -> bool:
+    full_path = os.path.join(local_dir, path)
+    return os.path.isfile(full_path) and os.path.getsize(full_path) == size
+
+
+def sync_model(
+    model_name: str,
+    models_dir: str,
+    source,
+    allow_patterns: list[str] = ALLOW_PATTERNS,
+) -> bool:
+    """
+    Brings `models_dir/<model_name>` up to date with `source` and returns
+    whether anything on disk changed.
+    """
+    local_dir = os.path.join(models_dir, model_name)
+    manifest = read_manifest(local_dir)
+    revision = source.revision(model_name)
+
+    if manifest["revision"] == revision and all(
+        on_disk(local_dir, path, entry["size"])
+        for path, entry in manifest["files"].items()
+    ):
+        print(f"{model_name} is up to date at {revision}")
+        return False
+
+    files = select_files(source.list_files(model_name, revision), allow_patterns)
+    stale = [
+        file.path
+        for file in files
+        if manifest["files"].get(file.path)
+        != {"size": file.size, "digest": file.digest}
+        or not on_disk(local_dir, file.path, file.size)
+    ]
+    removed = set(manifest["files"]) - {file.path for file in files}
+
+    print(
+        f"{model_name}: fetching {len(stale)} of {len(files)} files"
+        f" ({sum(file.size for file in files if file.path in stale)} bytes),"
+        f" removing {len(removed)}"
+    )
+    os.makedirs(local_dir, exist_ok=True)
+    if stale:
+        source.fetch(model_name, revision, stale, local_dir)
+    for path in removed:
+        full_path = os.path.join(local_dir, path)
+        if os.path.exists(full_path):
+            os.remove(full_path)
+
+    for file in files:
+        if not on_disk(local_dir, file.path, file.size):
+            raise RuntimeError(f"{model_name}: {file.path} did not download intact")
+    write_manifest(local_dir, revision, files)
+    return True
+
+
+def sync_models(
+    model_names: list[str], models_dir: str, source, max_workers: int = 4
+) -> dict[str, bool]:
+    """`sync_model` for several models at once; returns which ones changed."""
+    with ThreadPoolExecutor(max_workers) as executor:
+        changed = executor.map(
+            lambda model_name: sync_model(model_name, models_dir, source),
+            model_names,
+        )
+        return dict(zip(model_names, changed))
 
 
 @app.function(
@@ -28,13 +241,35 @@ with download_image.imports():
     timeout=DOWNLOAD_TIMEOUT,
     image=download_image,
 )
-def download_model(model_name: str):
+def download_model(model_name: str) -> bool:
+    # A fresh container mounts the latest committed volume, so no reload needed.
+    with span("model_sync", model=model_name) as s:
+        changed = sync_model(model_name, MODELS_DIR, HubSource())
+        if changed:
+            volume.commit()
+    print(f"Syncing {model_name} complete in {s.seconds} seconds")
+    return changed
+
+
+@app.local_entrypoint()
+def prefetch(models: str):
+    """Syncs several comma-separated models in parallel containers."""
+    model_names = models.split(",")
+    for model_name, changed in zip(model_names, download_model.map(model_names)):
+        print(f"{model_name}: {'updated' if changed else 'up to date'}")
+
+
+if __name__ == "__main__":
+    # Sync from a local directory laid out like the hub, e.g. to try it out:
+    # python -m fim_eval.download_model --source-dir hub --models-dir models m1 m2
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model_names", nargs="+")
+    parser.add_argument("--source-dir", required=True)
+    parser.add_argument("--models-dir", required=True)
+    args = parser.parse_args()
+
     t0 = time.time()
-    volume.reload()
-    snapshot_download(
-        model_name,
-        local_dir=MODELS_DIR + "/" + model_name,
+    changed = sync_models(
+        args.model_names, args.models_dir, LocalDirSource(args.source_dir)
     )
-    volume.commit()
-    t1 = time.time()
-    print(f"Downloading {model_name} complete in {t1 - t0} seconds")
+    print(f"{changed} in {time.time() - t0} seconds")
@@ -1,155 +1,416 @@
-import gzip
-import itertools
+"""
+Executes results files against the problems' tests and scores the verdicts.
+Run it through `python -m fim_eval.cli`.
+
+Heavy dependencies (numpy, tqdm, rich, pydantic) are imported where they
+are used, so scoring or reporting on a verdicts file starts quickly.
+"""
+
+import hashlib
+import heapq
 import json
 import os
-import tqdm
-from typing import Union, List
+import time
 from collections import defaultdict
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Optional
 
-import requests
-from rich.console import Console
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import numpy as np
+from concurrent.futures import FIRST_COMPLETED, Future, as_completed, wait
 
-from fim_eval.execution import check_correctness
-from fim_eval.load_problems import Problem
-from fim_eval.result import Result as Sample
+from fim_eval.execution import ExecutionPool, ResourceLimits
+from fim_eval.datasets import (
+    DEFAULT_DATASET,
+    Subset,
+    dataset_path,
+    download_datasets,
+    load_dataset,
+)
+from fim_eval.records import ResultRecord as Sample
+from fim_eval.verdict_cache import VerdictCache, completion_digest, problem_digest
+
+if TYPE_CHECKING:
+    from fim_eval.load_problems import Problem
 
 MAX_WORKERS = 16
+MAX_JOBS_PER_WORKER = 100
+# Per-execution envelope; keeps MAX_WORKERS sandboxes from pushing the host into swap.
+LIMITS = ResourceLimits(
+    max_memory_bytes=4 * 2**30, max_cpu_seconds=30, max_output_bytes=2**20
+)
+# Samples submitted to the pool but not yet written to the verdicts file.
+MAX_IN_FLIGHT = 4 * MAX_WORKERS
+FOLLOW_POLL_INTERVAL = 0.5
+FOLLOW_IDLE_TIMEOUT = 60
 K = [1, 3, 5]
+DATA_DIR = os.path.join(os.getcwd(), "data")
+DATASET_PATH = dataset_path(DEFAULT_DATASET, DATA_DIR)
+RESULTS_PATH = os.path.join(DATA_DIR, "results.jsonl")
 
-console = Console()
 
+def dataset_file(dataset: str = DEFAULT_DATASET) -> str:
+    return dataset_path(dataset, DATA_DIR)
 
-def download_eval():
-    url = "https://raw.githubusercontent.com/openai/human-eval-infilling/88062ff9859c875d04db115b698ed4b0f0395170/data/HumanEval-SingleLineInfilling.jsonl.gz"
 
-    full_path = os.path.join(
-        os.getcwd(), "data", "HumanEval-SingleLineInfilling.jsonl.gz"
-    )
+def download_eval(dataset: str = DEFAULT_DATASET):
+    download_datasets([dataset], DATA_DIR)
 
-    # Check if file exists using regular file operations
-    if os.path.exists(full_path):
-        print(f"File {full_path} already exists")
-        return
 
-    response = requests.get(url)
-    response.raise_for_status()
+def load_eval(
+    dataset: str = DEFAULT_DATASET, subset: Subset = Subset()
+) -> list["Problem"]:
+    return load_dataset(dataset, DATA_DIR, subset)
 
-    with open(full_path, "wb") as f:
-        f.write(response.content)
 
+def iter_samples(
+    path: str = RESULTS_PATH, follow: bool = False
+) -> Iterator[tuple[int, Sample]]:
+    """
+    Yields (completion_id, sample) for each line of a results file, where the
+    completion_id is the line number.
 
-def load_eval() -> list[Problem]:
-    problems: list[Problem] = []
+    With `follow`, keeps waiting for lines appended by a writer until the file
+    has not grown for `FOLLOW_IDLE_TIMEOUT` seconds.
+    """
+    completion_id = 0
+    pending = ""
+    idle_since = time.monotonic()
+    with open(path, "r") as f:
+        while True:
+            line = f.readline()
+            if line:
+                pending += line
+                idle_since = time.monotonic()
+                # A line without a newline is still being written.
+                if pending.endswith("\n"):
+                    yield completion_id, Sample.validate_json(pending)
+                    completion_id += 1
+                    pending = ""
+                continue
+            if not follow or time.monotonic() - idle_since > FOLLOW_IDLE_TIMEOUT:
+                break
+            time.sleep(FOLLOW_POLL_INTERVAL)
+
+    if pending.strip():
+        yield completion_id, Sample.validate_json(pending)
 
-    with gzip.open(
-        os.path.join(os.getcwd(), "data", "HumanEval-SingleLineInfilling.jsonl.gz"),
-        "rb",
-    ) as f:
-        for line in f:
-            problems.append(Problem(**json.loads(line)))
 
-    return problems
+def load_samples() -> list[Sample]:
+    return [sample for _, sample in iter_samples()]
 
 
-def load_samples() -> list[Sample]:
-    samples: list[Sample] = []
+def verdicts_path(results_path: str) -> str:
+    """data/results.jsonl -> data/results.verdicts.jsonl"""
+    return results_path.removesuffix(".jsonl") + ".verdicts.jsonl"
 
-    with open(os.path.join(os.getcwd(), "data", "results.jsonl"), "r") as f:
-        for line in f:
-            samples.append(Sample(**json.loads(line)))
 
-    return samples
+def iter_verdicts(path: str) -> Iterator[dict]:
+    if not os.path.exists(path):
+        return
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                verdict = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn write from an interrupted run; that sample is redone.
+                continue
+            if "sidecar" not in verdict:
+                yield verdict
 
 
-def evaluate_results(samples: list[Sample], problems: list[Problem]):
-    print(f"Evaluating {len(samples)} samples and {len(problems)} problems...")
+def sidecar_header(results_path: str, problem_digests: dict[str, str]) -> dict:
+    """
+    The first line of a verdicts file: which results file and which version
+    of the problems its verdicts belong to.
+    """
+    problems = hashlib.sha256()
+    for task_id in sorted(problem_digests):
+        problems.update(f"{task_id}:{problem_digests[task_id]}\n".encode())
+    return {
+        "sidecar": {
+            "results": os.path.abspath(results_path),
+            "problems": problems.hexdigest(),
+        }
+    }
+
+
+def read_sidecar_header(path: str) -> Optional[dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        try:
+            header = json.loads(f.readline())
+        except json.JSONDecodeError:
+            return None
+    return header if "sidecar" in header else None
+
+
+def evaluate_results(
+    results_path: str,
+    problem_by_id: dict[str, "Problem"],
+    pool: ExecutionPool,
+    timeouts: dict[str, float],
+    cache: VerdictCache,
+    follow: bool = False,
+):
+    """
+    Streams samples from `results_path` into the pool and appends each verdict
+    to the sidecar file as it completes. Samples that already have a verdict
+    for the same task, problem and completion are skipped, so an interrupted
+    run resumes where it stopped. A sidecar written for another results file
+    or another version of the problems is started over. At most
+    `MAX_IN_FLIGHT` samples are held in memory.
+
+    Verdicts found in `cache` are written without executing anything, and new
+    verdicts are added to it. Samples of tasks missing from `problem_by_id`,
+    e.g. outside the subset being evaluated, are skipped.
+    """
+    print(f"Evaluating {results_path}")
+    evaluate_samples(
+        (
+            (completion_id, sample)
+            for completion_id, sample in iter_samples(results_path, follow=follow)
+            if sample.task_id in problem_by_id
+        ),
+        results_path,
+        problem_by_id,
+        pool,
+        timeouts,
+        cache,
+    )
 
 
-def estimate_pass_at_k(
-    num_samples: Union[int, List[int], np.ndarray],
-    num_correct: Union[List[int], np.ndarray],
-    k: int,
-) -> np.ndarray:
+def evaluate_samples(
+    samples: Iterable[tuple[int, Sample]],
+    results_path: str,
+    problem_by_id: dict[str, "Problem"],
+    pool: ExecutionPool,
+    timeouts: dict[str, float],
+    cache: VerdictCache,
+    on_verdict: Optional[Callable[[dict], None]] = None,
+):
+    """
+    `evaluate_results` for any stream of (completion_id, sample) pairs.
+    Consuming `samples` blocks while `MAX_IN_FLIGHT` samples are executing,
+    which is what applies backpressure to whoever produces them.
+    `on_verdict` is called with every verdict as it is written.
     """
-    Estimates pass@k of each problem and returns them in an array.
+    import tqdm
+
+    sidecar = verdicts_path(results_path)
+    problem_digests = {
+        task_id: problem_digest(problem.model_dump())
+        for task_id, problem in problem_by_id.items()
+    }
+    header = sidecar_header(results_path, problem_digests)
+    resume = os.path.exists(sidecar) and read_sidecar_header(sidecar) == header
+    if os.path.exists(sidecar) and not resume:
+        print(
+            f"{sidecar} was written for another results file or dataset, starting over"
+        )
+
+    # A verdict is reused only for the same task, problem and completion.
+    done: dict[int, tuple[str, str, str]] = {}
+    if resume:
+        done = {
+            verdict["completion_id"]: (
+                verdict["task_id"],
+                verdict["problem_digest"],
+                verdict["completion_digest"],
+            )
+            for verdict in iter_verdicts(sidecar)
+        }
+    print(f"{len(done)} verdicts already in {sidecar}")
+
+    # Terminate a torn last line so the next verdict starts on its own line.
+    torn = False
+    if resume:
+        with open(sidecar, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            torn = f.read(1) != b"\n"
+
+    with open(sidecar, "a" if resume else "w") as out:
+        if torn:
+            out.write("\n")
+        if not resume:
+            out.write(json.dumps(header) + "\n")
+
+        # Each in-flight future maps to its sample and the key of its verdict.
+        in_flight: dict[Future, tuple[Sample, tuple[str, str, str]]] = {}
+
+        def write(verdict: dict, key: tuple[str, str, str]):
+            _, verdict["problem_digest"], verdict["completion_digest"] = key
+            out.write(json.dumps(verdict) + "\n")
+            progress.update()
+            if on_verdict is not None:
+                on_verdict(verdict)
+
+        def write_finished(futures: Iterable[Future]):
+            for future in futures:
+                verdict = future.result()
+                sample, key = in_flight.pop(future)
+                cache.put(
+                    problem_by_id[sample.task_id].model_dump(),
+                    sample.completion,
+                    verdict,
+                )
+                write(verdict, key)
+            out.flush()
+
+        with tqdm.tqdm() as progress:
+            for completion_id, sample in samples:
+                key = (
+                    sample.task_id,
+                    problem_digests[sample.task_id],
+                    completion_digest(sample.completion),
+                )
+                if done.get(completion_id) == key:
+                    continue
+
+                problem = problem_by_id[sample.task_id].model_dump()
+                cached = cache.get(problem, sample.completion)
+                if cached is not None:
+                    verdict = dict(
+                        task_id=sample.task_id, completion_id=completion_id, **cached
+                    )
+                    write(verdict, key)
+                    continue
+
+                if len(in_flight) >= MAX_IN_FLIGHT:
+                    finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    write_finished(finished)
+
+                future = pool.submit(
+                    problem,
+                    sample.completion,
+                    timeouts[sample.task_id],
+                    completion_id=completion_id,
+                )
+                in_flight[future] = (sample, key)
+
+            write_finished(as_completed(list(in_flight)))
+
+    print(f"Verdict cache: {cache.stats()}")
+
+
+def latest_verdicts(path: str) -> list[dict]:
+    """
+    The latest verdict of each completion in a verdicts file, since a
+    completion re-evaluated after its sample changed is appended again.
     """
+    latest: dict[int, dict] = {}
+    for verdict in iter_verdicts(path):
+        latest[verdict["completion_id"]] = verdict
+    return list(latest.values())
 
-    def estimator(n: int, c: int, k: int) -> float:
-        """
-        Calculates 1 - comb(n - c, k) / comb(n, k).
-        """
-        if n - c < k:
-            return 1.0
-        return 1.0 - np.prod(1.0 - k / np.arange(n - c + 1, n + 1))
-
-    if isinstance(num_samples, int):
-        num_samples_it = itertools.repeat(num_samples, len(num_correct))
-    else:
-        assert len(num_samples) == len(num_correct)
-        num_samples_it = iter(num_samples)
-
-    return np.array(
-        [estimator(int(n), int(c), k) for n, c in zip(num_samples_it, num_correct)]
-    )
+
+def score_results(path: str) -> int:
+    """
+    Accuracy and pass@k over the latest verdict of each completion. Returns
+    how many completions were scored.
+    """
+    from fim_eval.pass_at_k import summarize_pass_at_k
+
+    attempts: dict[str, int] = defaultdict(int)
+    successes: dict[str, int] = defaultdict(int)
+    for verdict in latest_verdicts(path):
+        task_id, passed = verdict["task_id"], verdict["passed"]
+        attempts[task_id] += 1
+        successes[task_id] += passed
+
+    total = sum(attempts.values())
+    if not total:
+        print(f"no verdicts in {path}")
+        return 0
+    passed = sum(successes.values())
+    print(f"Accuracy: {passed / total} = {passed} / {total}")
+
+    task_ids = list(attempts)
+    for pass_at_k in summarize_pass_at_k(
+        [attempts[task_id] for task_id in task_ids],
+        [successes[task_id] for task_id in task_ids],
+        K,
+    ):
+        print(
+            f"Pass@{pass_at_k.k}: {pass_at_k.estimate}"
+            f" (95% CI {pass_at_k.lower:.4f} - {pass_at_k.upper:.4f})"
+        )
+    return total
+
+
+def cpu_time(verdict: dict) -> float:
+    return (verdict.get("user_time") or 0.0) + (verdict.get("system_time") or 0.0)
+
+
+def print_resource_report(path: str, top: int = 10):
+    """
+    The most expensive problems and completions by CPU time, over the latest
+    verdict of each completion in a verdicts file. Wall time includes waiting
+    on the deadline for timeouts.
+    """
+    verdicts = latest_verdicts(path)
+    cpu_by_task: dict[str, float] = defaultdict(float)
+    wall_by_task: dict[str, float] = defaultdict(float)
+    rss_by_task: dict[str, int] = defaultdict(int)
+    for verdict in verdicts:
+        task_id = verdict["task_id"]
+        cpu_by_task[task_id] += cpu_time(verdict)
+        wall_by_task[task_id] += verdict["elapsed"]
+        rss_by_task[task_id] = max(rss_by_task[task_id], verdict.get("max_rss") or 0)
+
+    total_cpu = sum(cpu_by_task.values())
+    total_wall = sum(wall_by_task.values())
+    print(f"Total sandbox time: {total_cpu:.2f}s CPU, {total_wall:.2f}s wall")
+
+    print(f"Most expensive problems (top {top} by CPU time):")
+    for task_id in heapq.nlargest(top, cpu_by_task, key=cpu_by_task.get):
+        print(
+            f"  {task_id}: {cpu_by_task[task_id]:.3f}s CPU"
+            f" ({cpu_by_task[task_id] / (total_cpu or 1.0):.1%}),"
+            f" {wall_by_task[task_id]:.3f}s wall,"
+            f" peak RSS {rss_by_task[task_id] / 2**20:.1f} MiB"
+        )
+
+    print(f"Most expensive completions (top {top} by CPU time):")
+    for verdict in heapq.nlargest(top, verdicts, key=cpu_time):
+        print(
+            f"  {verdict['task_id']} #{verdict['completion_id']}"
+            f" [{verdict['status']}]: {cpu_time(verdict):.3f}s CPU,"
+            f" {verdict['elapsed']:.3f}s wall,"
+            f" peak RSS {(verdict.get('max_rss') or 0) / 2**20:.1f} MiB"
+        )
+
+
+def print_failures(results_path: str, problem_by_id: dict[str, "Problem"], limit: int):
+    """Debug some number of failed results"""
+    from rich.console import Console
+
+    console = Console()
+    failed = {
+        verdict["completion_id"]
+        for verdict in latest_verdicts(verdicts_path(results_path))
+        if not verdict["passed"]
+    }
+    num_failed = 0
+    for completion_id, sample in iter_samples(results_path):
+        if completion_id not in failed:
+            continue
+        print(f"task id failed: {sample.task_id}")
+        num_failed += 1
+        problem = problem_by_id[sample.task_id]
+        console.print(
+            "-" * 30,
+            "\n",
+            f"{problem.prompt}[yellow on grey23]{sample.completion}[/yellow on grey23]{problem.suffix}",
+            "\n",
+            "-" * 30,
+        )
+        if num_failed >= limit:
+            break
 
 
 if __name__ == "__main__":
-    download_eval()
-    problems = load_eval()
-    samples = load_samples()
-    problem_by_id = {problem.task_id: problem for problem in problems}
-
-    results_by_id = defaultdict(list)
-    flat_results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for i, sample in enumerate(samples):
-            future = executor.submit(
-                check_correctness,
-                problem_by_id[sample.task_id].model_dump(),
-                sample.completion,
-                10,
-                completion_id=i,
-            )
-            futures.append(future)
-
-        for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
-            task_id = future.result()["task_id"]
-            results_by_id[task_id].append(future.result())
-            flat_results.append(future.result())
-
-    passed = sum(result["passed"] for result in flat_results)
-    print(f"Accuracy: {passed / len(flat_results)} = {passed} / {len(flat_results)}")
-
-    # Debug some number of failed results
-    # num_failed = 0
-    # for result in flat_results:
-    #     if not result["passed"]:
-    #         sample = samples[result["completion_id"]]
-    #         print(f"task id failed: {result['task_id']}")
-    #         num_failed += 1
-    #         problem = problem_by_id[result["task_id"]]
-    #         console.print(
-    #             "-" * 30,
-    #             "\n",
-    #             f"{problem.prompt}[yellow on grey23]{sample.completion}[/yellow on grey23]{problem.suffix}",
-    #             "\n",
-    #             "-" * 30,
-    #         )
-    #     if num_failed >= 10:
-    #         break
-
-    num_attempts_per_problem = [len(results) for results in results_by_id.values()]
-    num_successes_per_problem = [
-        sum(result["passed"] for result in results)
-        for results in results_by_id.values()
-    ]
-    for k in K:
-        pass_at_k = estimate_pass_at_k(
-            num_attempts_per_problem,
-            num_successes_per_problem,
-            k=k,
-        ).mean()
-        print(f"Pass@{k}: {pass_at_k}")
+    # Kept for `python -m fim_eval.evaluate_fim_results`; see fim_eval.cli.
+    import sys
+
+    from fim_eval.cli import main
+
+    main(["evaluate", *sys.argv[1:]])
@@ -1,17 +1,79 @@
 # From https://github.com/openai/human-eval-infilling/
 import contextlib
 import faulthandler
+import gc
 import io
+import math
 import multiprocessing
 import os
+import pickle
 import platform
+import queue
+import resource
+import select
+import shutil
 import signal
 import tempfile
-from typing import Dict, Optional
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, NamedTuple, Optional
+
+from fim_eval.tracing import span
+
+# Bump whenever a change to the harness can change a verdict, which invalidates
+# every cached verdict.
+HARNESS_VERSION = "4"
+
+PASSED = "passed"
+FAILED = "failed"
+TIMED_OUT = "timed out"
+# The sandbox process died without reporting a verdict.
+CRASHED = "crashed"
+# The check program broke its ResourceLimits.
+RESOURCE_EXCEEDED = "resource exceeded"
+
+
+class ResourceLimits(NamedTuple):
+    """
+    Envelope for a single execution. Memory caps the sandbox's address space,
+    CPU caps the CPU seconds a single job may use, and output caps how much a
+    job may write to stdout and stderr. None disables a limit.
+    """
+
+    max_memory_bytes: Optional[int] = 4 * 2**30
+    max_cpu_seconds: Optional[float] = 30
+    max_output_bytes: Optional[int] = 2**20
+
+
+DEFAULT_LIMITS = ResourceLimits()
+
+
+class Verdict(NamedTuple):
+    status: str
+    exception_type: Optional[str] = None
+    message: str = ""
+    # Wall time of the check program, in seconds.
+    elapsed: float = 0.0
+    # CPU seconds and peak resident set size in bytes of the sandbox while
+    # running the check program. None when the sandbox never reported back.
+    user_time: Optional[float] = None
+    system_time: Optional[float] = None
+    max_rss: Optional[int] = None
+
+    @property
+    def result(self) -> str:
+        """The original human-eval result string."""
+        if self.status == FAILED:
+            return f"failed: {self.message}"
+        return self.status
 
 
 def check_correctness(
-    problem: Dict, completion: str, timeout: float, completion_id: Optional[int] = None
+    problem: Dict,
+    completion: str,
+    timeout: float,
+    completion_id: Optional[int] = None,
+    limits: ResourceLimits = DEFAULT_LIMITS,
 ) -> Dict:
     """
     Evaluates the functional correctness of a completion by running the test
@@ -21,29 +83,389 @@ def check_correctness(
         the results later even if execution finishes asynchronously.
     """
 
-    manager = multiprocessing.Manager()
-    result = manager.list()
+    conn, child_conn = multiprocessing.Pipe(duplex=False)
 
     p = multiprocessing.Process(
-        target=unsafe_execute, args=(problem, completion, result, timeout)
+        target=unsafe_execute,
+        args=(problem, completion, child_conn, timeout, limits),
     )
     p.start()
-    p.join(timeout=timeout + 1)
+    child_conn.close()
+
+    verdict = None
+    if conn.poll(timeout + 1):
+        try:
+            verdict = conn.recv()
+        except EOFError:
+            pass
+    else:
+        verdict = _deadline_passed(timeout)
     if p.is_alive():
         p.kill()
+    p.join()
+    conn.close()
+
+    # The pipe closed without a verdict, so the sandbox died mid-job.
+    if verdict is None:
+        verdict = _crashed(p.exitcode)
+
+    return _result_dict(problem, verdict, completion_id)
+
 
-    if not result:
-        result.append("timed out")
+def _deadline_passed(timeout: float) -> Verdict:
+    return Verdict(TIMED_OUT, message="no verdict before deadline", elapsed=timeout + 1)
 
+
+def _crashed(exitcode: Optional[int]) -> Verdict:
+    return Verdict(CRASHED, message=f"sandbox exited with code {exitcode}")
+
+
+def _result_dict(problem: Dict, verdict: Verdict, completion_id: Optional[int]) -> Dict:
     return dict(
         task_id=problem["task_id"],
-        passed=result[0] == "passed",
-        result=result[0],
+        passed=verdict.status == PASSED,
+        result=verdict.result,
         completion_id=completion_id,
+        status=verdict.status,
+        exception_type=verdict.exception_type,
+        message=verdict.message,
+        elapsed=verdict.elapsed,
+        user_time=verdict.user_time,
+        system_time=verdict.system_time,
+        max_rss=verdict.max_rss,
     )
 
 
-def unsafe_execute(problem, completion, result, timeout):
+class ExecutionPool:
+    """
+    A pool of pre-started sandbox workers that each run a stream of
+    (problem, completion) jobs, so a completion costs a pipe round trip instead
+    of two process startups.
+
+    Each worker is a fork server: it runs every job in a fresh fork of itself,
+    forked and guarded before the job arrives, which costs far less than a
+    process startup. It never runs a check program itself, so no job can
+    observe side effects of a previous one. A
+    worker is recycled after `max_jobs_per_worker` jobs or when it stops
+    answering.
+    """
+
+    def __init__(
+        self,
+        num_workers: Optional[int] = None,
+        max_jobs_per_worker: int = 100,
+        limits: ResourceLimits = DEFAULT_LIMITS,
+    ):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        for _ in range(self.num_workers):
+            self._idle.put(_Worker(max_jobs_per_worker, limits))
+        self._executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def check_correctness(
+        self,
+        problem: Dict,
+        completion: str,
+        timeout: float,
+        completion_id: Optional[int] = None,
+    ) -> Dict:
+        """
+        Same contract as the module level `check_correctness`, but runs on a
+        warm worker. Blocks until a worker is free.
+        """
+        with span("execute", task_id=problem["task_id"]) as s:
+            worker = self._idle.get()
+            try:
+                verdict = worker.run(problem, completion, timeout)
+            finally:
+                self._idle.put(worker)
+            s.args["status"] = verdict.status
+
+        return _result_dict(problem, verdict, completion_id)
+
+    def submit(
+        self,
+        problem: Dict,
+        completion: str,
+        timeout: float,
+        completion_id: Optional[int] = None,
+    ) -> Future:
+        return self._executor.submit(
+            self.check_correctness, problem, completion, timeout, completion_id
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for _ in range(self.num_workers):
+            self._idle.get().stop()
+
+    def __enter__(self) -> "ExecutionPool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Worker:
+    """Parent-side handle on one sandbox worker process."""
+
+    def __init__(self, max_jobs: int, limits: ResourceLimits):
+        self.max_jobs = max_jobs
+        self.limits = limits
+        self._start()
+
+    def _start(self):
+        self.jobs = 0
+        self.root = tempfile.mkdtemp(prefix="fim-eval-worker-")
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_worker_loop,
+            args=(child_conn, self.root, self.max_jobs, self.limits),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def run(self, problem: Dict, completion: str, timeout: float) -> Verdict:
+        self.jobs += 1
+        hung = False
+        try:
+            self.conn.send((problem, completion, timeout))
+            # The worker kills a job's fork at timeout + 1, so this only
+            # fires if the worker itself is stuck.
+            if self.conn.poll(timeout + 2):
+                verdict, retire = self.conn.recv(), False
+            else:
+                verdict, retire, hung = _deadline_passed(timeout), True, True
+        except (EOFError, OSError):
+            self.process.join(timeout=1)
+            verdict, retire = _crashed(self.process.exitcode), True
+
+        if retire or self.jobs >= self.max_jobs:
+            self.stop(kill=hung)
+            self._start()
+        return verdict
+
+    def stop(self, kill: bool = False):
+        if not kill:
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def _worker_loop(conn, root: str, max_jobs: int, limits: ResourceLimits):
+    # Done once here instead of by reliability_guard in every fork.
+    import subprocess  # noqa: F401
+
+    platform.uname()
+    # Keeps the forks' garbage collections off the worker's objects, which
+    # would otherwise copy most of its pages into every fork.
+    gc.freeze()
+    workdir = os.path.join(root, "job")
+    os.mkdir(workdir)
+    spare = _Spare.fork(conn, workdir, limits)
+    try:
+        for _ in range(max_jobs):
+            try:
+                job = conn.recv()
+            except EOFError:
+                break
+            if job is None:
+                break
+
+            conn.send(spare.run(*job))
+            if os.listdir(workdir):
+                shutil.rmtree(workdir, ignore_errors=True)
+                os.mkdir(workdir)
+            spare = _Spare.fork(conn, workdir, limits)
+    finally:
+        spare.kill()
+
+
+class _Spare(NamedTuple):
+    """
+    A guarded fork of the worker waiting for its one job. The worker forks the
+    next spare as soon as a verdict is sent, so the fork and the guard are paid
+    while the parent handles the verdict rather than when the job arrives.
+    Only the spare runs the check program, so whatever a job does to builtins,
+    imported modules or `sys.modules` dies with it and the worker stays clean.
+    """
+
+    pid: int
+    job_fd: int
+    verdict_fd: int
+
+    @classmethod
+    def fork(cls, conn, workdir: str, limits: ResourceLimits) -> "_Spare":
+        job_read, job_write = os.pipe()
+        verdict_read, verdict_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            _exit, read, write = os._exit, os.read, os.write
+            try:
+                conn.close()
+                os.close(job_write)
+                os.close(verdict_read)
+                os.chdir(workdir)
+                reliability_guard(limits.max_memory_bytes)
+                chunks = []
+                while chunk := read(job_read, 2**16):
+                    chunks.append(chunk)
+                problem, completion, timeout = pickle.loads(b"".join(chunks))
+                verdict = run_check_program(
+                    build_check_program(problem, completion), timeout, limits
+                )
+                payload = pickle.dumps(verdict)
+                while payload:
+                    payload = payload[write(verdict_write, payload) :]
+            finally:
+                _exit(0)
+
+        os.close(job_read)
+        os.close(verdict_write)
+        return cls(pid, job_write, verdict_read)
+
+    def run(self, problem: Dict, completion: str, timeout: float) -> Verdict:
+        """Hands the spare its job and collects the verdict, killing it at the deadline."""
+        deadline = time.monotonic() + timeout + 1
+        payload = pickle.dumps((problem, completion, timeout))
+        try:
+            while payload:
+                payload = payload[os.write(self.job_fd, payload) :]
+        except BrokenPipeError:
+            pass  # The spare died before reading its job; reported below.
+        os.close(self.job_fd)
+
+        verdict = None
+        chunks = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if (
+                remaining <= 0
+                or not select.select([self.verdict_fd], [], [], remaining)[0]
+            ):
+                os.kill(self.pid, signal.SIGKILL)
+                verdict = _deadline_passed(timeout)
+                break
+            chunk = os.read(self.verdict_fd, 2**16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(self.verdict_fd)
+        _, status = os.waitpid(self.pid, 0)
+
+        if verdict is None:
+            try:
+                verdict = pickle.loads(b"".join(chunks))
+            except Exception:
+                verdict = _crashed(os.waitstatus_to_exitcode(status))
+        return verdict
+
+    def kill(self):
+        """Stops a spare that never got a job."""
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+            os.waitpid(self.pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        for fd in (self.job_fd, self.verdict_fd):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+def build_check_program(problem: Dict, completion: str) -> str:
+    return (
+        problem["prompt"]
+        + completion
+        + problem["suffix"]
+        + "\n"
+        + problem["test"]
+        + "\n"
+        + f"check({problem['entry_point']})"
+    )
+
+
+def run_check_program(
+    check_program: str, timeout: float, limits: ResourceLimits = DEFAULT_LIMITS
+) -> Verdict:
+    peak_rss_reset = _reset_peak_rss()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+
+    status, exception_type, message = PASSED, None, ""
+    try:
+        exec_globals = {}
+        with swallow_io(limits.max_output_bytes), cpu_limit(limits.max_cpu_seconds):
+            with time_limit(timeout):
+                # WARNING
+                # This program exists to execute untrusted model-generated code. Although
+                # it is highly unlikely that model-generated code will do something overtly
+                # malicious in response to this test suite, model-generated code may act
+                # destructively due to a lack of model capability or alignment.
+                # Users are strongly encouraged to sandbox this evaluation suite so that it
+                # does not perform destructive actions on their host or network. For more
+                # information on how OpenAI sandboxes its code, see the accompanying paper.
+                # Once you have read this disclaimer and taken appropriate precautions,
+                # uncomment the following line and proceed at your own risk:
+                #                     exec(check_program, exec_globals)
+                exec(check_program, exec_globals)
+    except TimeoutException:
+        status, exception_type, message = TIMED_OUT, "TimeoutException", "Timed out!"
+    except (ResourceLimitExceeded, MemoryError) as e:
+        status, exception_type, message = RESOURCE_EXCEEDED, type(e).__name__, str(e)
+    except BaseException as e:
+        status, exception_type, message = FAILED, type(e).__name__, str(e)
+
+    elapsed = time.perf_counter() - start
+    try:
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        user_time = end_usage.ru_utime - usage.ru_utime
+        system_time = end_usage.ru_stime - usage.ru_stime
+        max_rss = _peak_rss(peak_rss_reset)
+    except BaseException:
+        # The check program broke something we rely on; its fork exits
+        # right after reporting anyway.
+        user_time = system_time = max_rss = None
+    return Verdict(
+        status, exception_type, message, elapsed, user_time, system_time, max_rss
+    )
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Resets this process's peak RSS high-water mark so a long-lived worker can
+    report the peak of a single job. Only supported on Linux.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss(since_reset: bool) -> int:
+    if since_reset:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    # Falls back to the peak over the whole life of the process.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if platform.uname().system == "Darwin" else max_rss * 1024
+
+
+def unsafe_execute(problem, completion, conn, timeout, limits=DEFAULT_LIMITS):
     with create_tempdir():
         # These system calls are needed when cleaning up tempdir.
         import os
@@ -54,40 +476,11 @@ def unsafe_execute(problem, completion, result, timeout):
         chdir = os.chdir
 
         # Disable functionalities that can make destructive changes to the test.
-        reliability_guard()
+        reliability_guard(limits.max_memory_bytes)
 
         # Construct the check program and run it.
-        check_program = (
-            problem["prompt"]
-            + completion
-            + problem["suffix"]
-            + "\n"
-            + problem["test"]
-            + "\n"
-            + f"check({problem['entry_point']})"
-        )
-
-        try:
-            exec_globals = {}
-            with swallow_io():
-                with time_limit(timeout):
-                    # WARNING
-                    # This program exists to execute untrusted model-generated code. Although
-                    # it is highly unlikely that model-generated code will do something overtly
-                    # malicious in response to this test suite, model-generated code may act
-                    # destructively due to a lack of model capability or alignment.
-                    # Users are strongly encouraged to sandbox this evaluation suite so that it
-                    # does not perform destructive actions on their host or network. For more
-                    # information on how OpenAI sandboxes its code, see the accompanying paper.
-                    # Once you have read this disclaimer and taken appropriate precautions,
-                    # uncomment the following line and proceed at your own risk:
-                    #                     exec(check_program, exec_globals)
-                    exec(check_program, exec_globals)
-            result.append("passed")
-        except TimeoutException:
-            result.append("timed out")
-        except BaseException as e:
-            result.append(f"failed: {e}")
+        check_program = build_check_program(problem, completion)
+        conn.send(run_check_program(check_program, timeout, limits))
 
         # Needed for cleaning up.
         shutil.rmtree = rmtree
@@ -109,8 +502,36 @@ def time_limit(seconds: float):
 
 
 @contextlib.contextmanager
-def swallow_io():
-    stream = WriteOnlyStringIO()
+def cpu_limit(seconds: Optional[float]):
+    """
+    Caps the CPU time of the enclosed block through RLIMIT_CPU. The limit is
+    cumulative for the process, so the soft limit is moved to the CPU time
+    used so far plus `seconds` and put back afterwards.
+    """
+    if seconds is None:
+        yield
+        return
+
+    def signal_handler(signum, frame):
+        raise CpuLimitExceeded(f"Used more than {seconds} CPU seconds")
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = math.ceil(usage.ru_utime + usage.ru_stime + seconds)
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    previous_handler = signal.signal(signal.SIGXCPU, signal_handler)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        signal.signal(signal.SIGXCPU, previous_handler)
+
+
+@contextlib.contextmanager
+def swallow_io(max_output_bytes: Optional[int] = None):
+    stream = BoundedOutputSink(max_output_bytes)
     with contextlib.redirect_stdout(stream):
         with contextlib.redirect_stderr(stream):
             with redirect_stdin(stream):
@@ -128,8 +549,39 @@ class TimeoutException(Exception):
     pass
 
 
-class WriteOnlyStringIO(io.StringIO):
-    """StringIO that throws an exception when it's read from"""
+class ResourceLimitExceeded(BaseException):
+    """
+    Derives from BaseException so that a check program's `except Exception`
+    cannot swallow it.
+    """
+
+
+class CpuLimitExceeded(ResourceLimitExceeded):
+    pass
+
+
+class OutputLimitExceeded(ResourceLimitExceeded):
+    pass
+
+
+class BoundedOutputSink(io.TextIOBase):
+    """
+    Write-only stream that discards everything written to it and raises once
+    more than `max_bytes` bytes have been written, so a runaway print loop
+    neither buffers unbounded output nor runs until its timeout.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.bytes_written = 0
+
+    def write(self, s: str) -> int:
+        self.bytes_written += len(s.encode("utf-8", "replace"))
+        if self.max_bytes is not None and self.bytes_written > self.max_bytes:
+            raise OutputLimitExceeded(
+                f"Wrote more than {self.max_bytes} bytes of output"
+            )
+        return len(s)
 
     def read(self, *args, **kwargs):
         raise IOError
@@ -0,0 +1,255 @@
+"""
+Downloads datasets into a content-addressed cache and verifies them.
+
+A dataset is fetched once per content hash: blobs live at
+`<cache>/blobs/sha256/<digest>` and `<cache>/pins.json` maps each URL to the
+digest it must have. Sources that do not ship an expected sha256 are pinned
+on first download (trust on first use), so a changed upstream file is caught
+on every later fetch instead of silently replacing the cached copy. Only a
+download can create a pin: a file already at the destination is adopted
+only if it matches a digest known beforehand.
+
+Blobs are copied to the destination, never linked, so editing a placed
+dataset cannot change the cache; a placed copy is re-verified on every fetch.
+
+Downloads stream to a `.part` file. When the origin supports range requests,
+large files are fetched as parallel chunks, and the chunks already on disk
+are recorded next to it so an interrupted download resumes where it stopped.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "FIM_EVAL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "fim_eval")
+)
+CHUNK_SIZE = 8 * 2**20
+MAX_CHUNK_WORKERS = 8
+STREAM_BLOCK_SIZE = 2**20
+REQUEST_TIMEOUT = 60
+
+
+class DatasetSource(NamedTuple):
+    # File name the dataset is placed under in the destination directory.
+    name: str
+    url: str
+    # Expected sha256; None pins whatever the first download returns.
+    sha256: Optional[str] = None
+
+
+# The HumanEval files are pinned by their first download until their digests
+# are filled in here from a verified copy.
+HUMANEVAL_SINGLE_LINE = DatasetSource(
+    "HumanEval-SingleLineInfilling.jsonl.gz",
+    "https://raw.githubusercontent.com/openai/human-eval-infilling/88062ff9859c875d04db115b698ed4b0f0395170/data/HumanEval-SingleLineInfilling.jsonl.gz",
+)
+HUMANEVAL_MULTI_LINE = DatasetSource(
+    "HumanEval-MultiLineInfilling.jsonl.gz",
+    "https://raw.githubusercontent.com/openai/human-eval-infilling/88062ff9859c875d04db115b698ed4b0f0395170/data/HumanEval-MultiLineInfilling.jsonl.gz",
+)
+HUMANEVAL_RANDOM_SPAN = DatasetSource(
+    "HumanEval-RandomSpanInfilling.jsonl.gz",
+    "https://raw.githubusercontent.com/openai/human-eval-infilling/88062ff9859c875d04db115b698ed4b0f0395170/data/HumanEval-RandomSpanInfilling.jsonl.gz",
+)
+
+
+class ChecksumMismatch(Exception):
+    pass
+
+
+_pins_lock = threading.Lock()
+
+
+def file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def blob_path(cache_dir: str, digest: str) -> str:
+    return os.path.join(cache_dir, "blobs", "sha256", digest)
+
+
+def read_pins(cache_dir: str) -> dict[str, str]:
+    try:
+        with open(os.path.join(cache_dir, "pins.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def pin(cache_dir: str, url: str, digest: str):
+    with _pins_lock:
+        pins = read_pins(cache_dir)
+        pins[url] = digest
+        path = os.path.join(cache_dir, "pins.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(pins, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+def expected_digest(source: DatasetSource, cache_dir: str) -> Optional[str]:
+    return source.sha256 or read_pins(cache_dir).get(source.url)
+
+
+def place(blob: str, path: str):
+    """Puts a copy of a cached blob at `path`."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    shutil.copyfile(blob, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def probe(url: str) -> tuple[Optional[int], bool]:
+    """The origin's content length, if known, and whether it serves ranges."""
+    # Imported here so loading an already fetched dataset does not pay for it.
+    import requests
+
+    response = requests.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    length = response.headers.get("Content-Length")
+    ranged = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(length) if length is not None else None), ranged
+
+
+def download_stream(url: str, part_path: str):
+    """Streams `url` to `part_path`, continuing a partial file with a range request."""
+    import requests
+
+    start = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={start}-"} if start else {}
+    with requests.get(
+        url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT
+    ) as response:
+        if response.status_code == 416:  # The partial file is already whole.
+            return
+        response.raise_for_status()
+        # 200 means the origin ignored the range and is sending everything.
+        mode = "ab" if response.status_code == 206 else "wb"
+        with open(part_path, mode) as f:
+            for block in response.iter_content(STREAM_BLOCK_SIZE):
+                f.write(block)
+
+
+def download_chunked(url: str, part_path: str, size: int, max_workers: int):
+    """
+    Fetches `url` as CHUNK_SIZE ranges written in place by parallel threads.
+    Finished chunks are listed in `<part>.chunks.json`, so a rerun only
+    fetches the rest.
+    """
+    import requests
+
+    state_path = part_path + ".chunks.json"
+    chunks = [
+        (start, min(start + CHUNK_SIZE, size)) for start in range(0, size, CHUNK_SIZE)
+    ]
+    done: set[int] = set()
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        with open(state_path) as f:
+            done = set(json.load(f))
+    else:
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+    lock = threading.Lock()
+
+    def fetch_chunk(index: int):
+        start, end = chunks[index]
+        headers = {"Range": f"bytes={start}-{end - 1}"}
+        with requests.get(
+            url, headers=headers, stream=True, timeout=REQUEST_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise IOError(f"{url} ignored the range request for chunk {index}")
+            fd = os.open(part_path, os.O_WRONLY)
+            try:
+                offset = start
+                for block in response.iter_content(STREAM_BLOCK_SIZE):
+                    os.pwrite(fd, block, offset)
+                    offset += len(block)
+            finally:
+                os.close(fd)
+        if offset != end:
+            raise IOError(f"{url} chunk {index} ended at {offset}, expected {end}")
+        with lock:
+            done.add(index)
+            with open(state_path + ".tmp", "w") as f:
+                json.dump(sorted(done), f)
+            os.replace(state_path + ".tmp", state_path)
+
+    pending = [index for index in range(len(chunks)) if index not in done]
+    with ThreadPoolExecutor(max_workers) as executor:
+        # list() re-raises the first failed chunk, after the others have run.
+        list(executor.map(fetch_chunk, pending))
+    os.remove(state_path)
+
+
+def fetch(
+    source: DatasetSource,
+    dest_dir: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    max_workers: int = MAX_CHUNK_WORKERS,
+) -> str:
+    """
+    Makes `dest_dir/<source.name>` hold the verified dataset and returns its
+    path. Only downloads when the cache has no blob with the expected digest.
+    """
+    path = os.path.join(dest_dir, source.name)
+    digest = expected_digest(source, cache_dir)
+    if digest is not None:
+        blob = blob_path(cache_dir, digest)
+        if os.path.exists(blob) and file_sha256(blob) != digest:
+            print(f"Removing corrupt cached blob {blob}")
+            os.remove(blob)
+        # A copy already at the destination (e.g. from before the cache) is
+        # kept when it matches, and seeds the cache if that has no blob yet.
+        if os.path.exists(path) and file_sha256(path) == digest:
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                place(path, blob)
+            return path
+        if os.path.exists(blob):
+            place(blob, path)
+            return path
+
+    downloads = os.path.join(cache_dir, "downloads")
+    os.makedirs(downloads, exist_ok=True)
+    part_path = os.path.join(
+        downloads, hashlib.sha256(source.url.encode()).hexdigest() + ".part"
+    )
+    print(f"Downloading {source.url}")
+    size, ranged = probe(source.url)
+    if ranged and size is not None and size > CHUNK_SIZE:
+        download_chunked(source.url, part_path, size, max_workers)
+    else:
+        download_stream(source.url, part_path)
+
+    actual = file_sha256(part_path)
+    if digest is not None and actual != digest:
+        os.remove(part_path)
+        raise ChecksumMismatch(f"{source.url} has sha256 {actual}, expected {digest}")
+    blob = blob_path(cache_dir, actual)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    os.replace(part_path, blob)
+    if digest is None:
+        print(f"Pinned {source.url} to sha256 {actual}")
+        pin(cache_dir, source.url, actual)
+    place(blob, path)
+    return path
+
+
+def fetch_all(
+    sources: list[DatasetSource],
+    dest_dir: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    max_workers: int = 4,
+) -> list[str]:
+    """`fetch` for several datasets at once; returns their paths in order."""
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(
+            executor.map(lambda source: fetch(source, dest_dir, cache_dir), sources)
+        )
@@ -1,15 +1,6 @@
-import gzip
-import json
-import os
-
-import modal
 from pydantic import BaseModel
 
-from fim_eval.constants import DATA_DIR, EVAL_VOLUME
-
-image = modal.Image.debian_slim().pip_install("requests", "pydantic")
-
-vol = modal.Volume.from_name(EVAL_VOLUME, create_if_missing=True)
+from fim_eval.constants import DATA_DIR
 
 
 class Problem(BaseModel):
@@ -21,13 +12,12 @@ class Problem(BaseModel):
     entry_point: str
 
 
-def load_problems() -> list[Problem]:
-    problems: list[Problem] = []
-
-    with gzip.open(
-        os.path.join(DATA_DIR, "HumanEval-SingleLineInfilling.jsonl.gz"), "rb"
-    ) as f:
-        for line in f:
-            problems.append(Problem(**json.loads(line)))
+def load_problems(dataset: str = "single-line", subset=None) -> list[Problem]:
+    """
+    The problems of `dataset` (one of fim_eval.datasets.DATASETS), narrowed to
+    a `Subset` if given, as LazyProblems over the dataset's column cache (see
+    fim_eval.problem_cache), which download_eval builds on the volume.
+    """
+    from fim_eval.datasets import Subset, load_dataset
 
-    return problems
+    return load_dataset(dataset, DATA_DIR, subset or Subset())
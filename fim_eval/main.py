@@ -1,19 +1,37 @@
 import os
-import time
-import json
+from typing import Optional
 
 import modal
 
 from fim_eval.app import app
+from fim_eval.backends import GenerationBackend, SamplingConfig, get_backend
 from fim_eval.download_eval import download_eval
-from fim_eval.download_model import download_model
-from fim_eval.constants import DATA_DIR, EVAL_VOLUME
+from fim_eval.download_model import download_model, model_revision
+from fim_eval.download_model import volume as model_volume
+from fim_eval.constants import DATA_DIR, EVAL_VOLUME, MODELS_DIR
+from fim_eval.datasets import Subset, get_dataset
 from fim_eval.load_problems import load_problems, Problem
-from fim_eval.result import Result
-from fim_eval.run_with_vllm import run_with_vllm
-# from fim_eval.run_with_transformers import run_with_transformers
+from fim_eval.pipeline import run_overlapped, write_results
+from fim_eval.profiles import GenerationProfile, get_profile, sampling_config
+from fim_eval.records import ResultRecord, pack_results, unpack_results
+from fim_eval.runs import assemble_results, run_generation, run_id
+from fim_eval.tracing import TRACER, enable, merge, recording, span
+
+# Imported so their Modal functions are registered on the app for the backends.
+import fim_eval.model_server  # noqa: F401
+import fim_eval.run_with_transformers  # noqa: F401
+import fim_eval.run_with_vllm  # noqa: F401
 
 SAMPLES_PER_PROBLEM = 5
+# One of fim_eval.backends.BACKENDS
+BACKEND = "vllm"
+# Generation containers running at once. Each generates fim_eval.runs.SHARD_SIZE
+# prompts per call, which are checkpointed as they finish.
+NUM_GENERATION_SHARDS = 1
+# One of fim_eval.datasets.DATASETS; its profile sets the stop criteria.
+DATASET = "single-line"
+# e.g. Subset(size=20, seed=0) for a quick stratified sample of the dataset.
+SUBSET = Subset()
 # MODEL_NAME = "deepseek-ai/deepseek-coder-1.3b-base"
 MODEL_NAME = "deepseek-ai/DeepSeek-Coder-V2-Lite-Base"
 
@@ -32,18 +50,39 @@ prompt = """<｜fim▁begin｜>def quick_sort(arr):
 
 
 @app.local_entrypoint()
-def main():
-    download_eval.remote()
-    download_model.remote(MODEL_NAME)
+def main(run_id: str = "", overlap: bool = False):
+    """
+    Pass --run-id to name the generation run: a new name regenerates from
+    scratch, an existing one resumes it. By default the id is derived from the
+    settings and the model revision.
+
+    With --overlap, generation is driven from here instead and completions
+    are executed locally as batches come back (fim_eval.pipeline).
+    """
+    enable()
+    path = os.path.join(os.getcwd(), "data", "results.jsonl")
+    with span("main", model=MODEL_NAME, dataset=DATASET):
+        with span("model_download"):
+            download_model.remote(MODEL_NAME)
 
-    results = load_and_solve_problems.remote()
+        if overlap:
+            solve_overlapped(path)
+        else:
+            with span("download_eval"):
+                download_eval.remote()
+            with span("load_and_solve_problems"):
+                response = load_and_solve_problems.remote(run_id or None)
+            merge(response["trace"])
+            with span("result_transfer", bytes=len(response["results"])):
+                results = unpack_results(response["results"])
 
-    # Write to a local file
-    path = os.path.join(os.getcwd(), "data", "results.jsonl")
-    with open(path, "w") as f:
-        for result in results:
-            line = json.dumps(result.model_dump())
-            f.write(line + "\n")
+            # Write to a local file
+            write_results(results, path)
+
+    # One file with the local and remote spans; open it in ui.perfetto.dev
+    trace_path = os.path.join(os.getcwd(), "data", "trace.json")
+    TRACER.write(trace_path)
+    print(f"Wrote trace to {trace_path}")
 
 
 image = (
@@ -55,46 +94,99 @@ image = (
 vol = modal.Volume.from_name(EVAL_VOLUME, create_if_missing=True)
 
 
-def construct_prompt(problem: Problem) -> str:
-    return f"<｜fim▁begin｜>{problem.prompt}<｜fim▁hole｜>{problem.suffix}<｜fim▁end｜>"
-
-
-@app.function(image=image, volumes={DATA_DIR: vol}, timeout=1200)
-def load_and_solve_problems() -> list[Result]:
-    t0 = time.time()
-    problems: list[Problem] = load_problems()
-
-    prompts = [construct_prompt(problem) for problem in problems]
-
-    # multiple samples per prompt to account for temperature effects
-    prompts = [prompt for prompt in prompts for _ in range(SAMPLES_PER_PROBLEM)]
-    repeated_problems = [
-        problem for problem in problems for _ in range(SAMPLES_PER_PROBLEM)
-    ]
-
-    # Running with vanilla transformers is too slow
-    # completions = run_with_transformers.remote(MODEL_NAME, prompts)
+# A retried call resumes the run from its last shard on the volume, so runs
+# longer than the timeout finish over several attempts.
+@app.function(
+    image=image,
+    volumes={DATA_DIR: vol, MODELS_DIR: model_volume},
+    timeout=1200,
+    retries=3,
+)
+def load_and_solve_problems(run_name: Optional[str] = None) -> dict:
+    """Returns {"results": packed results (fim_eval.records), "trace": [...]}."""
+    with recording("load_and_solve_problems") as tracer:
+        with span("solve_problems") as total:
+            results = solve_problems(run_name)
+        print(f"Time taken: {total.seconds}")
+
+        # Packed rather than pickled model instances
+        with span("pack_results", results=len(results)):
+            packed = pack_results(results)
+    return {"results": packed, "trace": tracer.collect()}
+
+
+def generation_settings(
+    problems: list[Problem],
+) -> tuple[GenerationBackend, GenerationProfile, SamplingConfig]:
+    # Running with vanilla transformers ("transformers") is too slow
+    # (timings below are from one prompt per generate call, before batching)
     # 23.75 seconds (10 problems)
     # 123.13 seconds (50 problems)
     # Timed out at 300s (100 problems)
 
-    # Running with vllm is faster
-    completions = run_with_vllm.remote(MODEL_NAME, prompts)
+    # Running with vllm ("vllm") is faster
     # 35.16 seconds (10 problems)
     # 35.31 seconds (100 problems)
 
-    results = [
-        Result(task_id=problem.task_id, completion=completion)
-        for problem, completion in zip(repeated_problems, completions)
-    ]
+    # "vllm-server" keeps the model loaded between calls, so repeated runs
+    # within the server's idle window skip the model load.
+    backend = get_backend(
+        BACKEND, model_name=MODEL_NAME, num_shards=NUM_GENERATION_SHARDS
+    )
+
+    # multiple samples per prompt to account for temperature effects, stopping
+    # at the end of the line instead of running on to max_tokens
+    profile = get_profile(get_dataset(DATASET).profile)
+    config = sampling_config(profile, problems, samples_per_prompt=SAMPLES_PER_PROBLEM)
+    print(f"Sampling with {config}")
+    return backend, profile, config
+
+
+def solve_problems(run_name: Optional[str] = None) -> list[ResultRecord]:
+    problems: list[Problem] = load_problems(DATASET, SUBSET)
+    backend, profile, config = generation_settings(problems)
+
+    # Completed shards are checkpointed to the volume as shards of the run. New
+    # weights get a new run unless the run is named.
+    revision = model_revision(MODEL_NAME)
+    run_name = run_name or run_id(MODEL_NAME, revision, config, problems)
+    run_dir = f"{DATA_DIR}/runs/{run_name}"
+    timings = run_generation(
+        run_dir,
+        problems,
+        backend,
+        config,
+        MODEL_NAME,
+        profile,
+        on_shard=vol.commit,
+        model_revision=revision,
+    )
+    print(f"Generation timings: {timings}")
 
     # Write to a volume
-    with open(f"{DATA_DIR}/results.jsonl", "w") as f:
-        for result in results:
-            line = json.dumps(result.model_dump())
-            f.write(line + "\n")
+    results = assemble_results(
+        run_dir, problems, SAMPLES_PER_PROBLEM, f"{DATA_DIR}/results.jsonl"
+    )
+    vol.commit()
+    return results
 
-    tf = time.time()
-    print(f"Time taken: {tf - t0}")
 
-    return results
+def solve_overlapped(results_path: str):
+    """
+    Generates from this process with the configured backend and executes
+    completions locally as batches finish, writing them to `results_path`.
+    """
+    from fim_eval import evaluate_fim_results as evaluation
+
+    evaluation.download_eval(DATASET)
+    problems = evaluation.load_eval(DATASET, SUBSET)
+    backend, profile, config = generation_settings(problems)
+    timings = run_overlapped(
+        backend,
+        config,
+        problems,
+        results_path,
+        profile,
+        dataset_path=evaluation.dataset_file(DATASET),
+    )
+    print(f"Overlapped timings: {timings}")
@@ -0,0 +1,159 @@
+"""
+A generation service that loads the model once per container and serves
+repeated generate requests, instead of reloading it on every call like
+`run_with_vllm`.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import modal
+
+from fim_eval.app import app
+from fim_eval.constants import MODELS_DIR
+from fim_eval.run_with_vllm import (
+    build_sampling_params,
+    generate_in_prefix_order,
+    image,
+    volume,
+)
+from fim_eval.tracing import Tracer, current, recording, span
+
+# Seconds a container stays up without requests before it is shut down and the
+# model has to be loaded again.
+IDLE_TIMEOUT = int(os.environ.get("FIM_MODEL_SERVER_IDLE_TIMEOUT", 300))
+MAX_CONCURRENT_REQUESTS = 8
+# How long the batcher waits for more requests to join a batch.
+BATCH_WINDOW_SECONDS = 0.05
+
+with image.imports():
+    from vllm import LLM
+
+
+class RequestBatcher:
+    """
+    Coalesces concurrent requests into single calls of `run_batch`, which
+    takes a flat list of prompts and one parameter object per prompt, as do
+    requests.
+    Requests arriving within `window` seconds of each other share a batch.
+
+    The batch runs on the batcher's thread, outside any request's trace, so
+    its spans are recorded separately and added to the trace of every request
+    in it.
+    """
+
+    def __init__(self, run_batch: Callable[[list[str], list], list], window: float):
+        self.run_batch = run_batch
+        self.window = window
+        self._pending: list[tuple[list[str], object, Future, Tracer]] = []
+        self._condition = threading.Condition()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, prompts: list[str], params: list) -> list:
+        future: Future = Future()
+        with self._condition:
+            self._pending.append((prompts, params, future, current()))
+            self._condition.notify()
+        return future.result()
+
+    def _loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending)
+            time.sleep(self.window)
+            with self._condition:
+                batch, self._pending = self._pending, []
+
+            prompts = [prompt for request, *_ in batch for prompt in request]
+            params = [p for _, request_params, *_ in batch for p in request_params]
+            error = None
+            with recording("batcher") as batch_trace:
+                try:
+                    with span("batch", requests=len(batch), prompts=len(prompts)):
+                        outputs = self.run_batch(prompts, params)
+                except BaseException as e:
+                    error = e
+            for *_, tracer in batch:
+                tracer.extend(batch_trace.events)
+
+            start = 0
+            for request, _, future, _ in batch:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(outputs[start : start + len(request)])
+                start += len(request)
+
+
+@app.cls(
+    image=image,
+    gpu=modal.gpu.A100(count=1, size="80GB"),
+    volumes={MODELS_DIR: volume},
+    timeout=1200,
+    container_idle_timeout=IDLE_TIMEOUT,
+    allow_concurrent_inputs=MAX_CONCURRENT_REQUESTS,
+)
+class ModelServer:
+    model_name: str = modal.parameter()
+
+    @modal.enter()
+    def load(self):
+        model_path = MODELS_DIR + "/" + self.model_name
+        with span("model_load") as load:
+            self.llm = LLM(
+                model=model_path, trust_remote_code=True, enable_prefix_caching=True
+            )
+        self.load_seconds = load.seconds
+        print(f"Model loaded in {self.load_seconds} seconds")
+        self.batcher = RequestBatcher(self._generate_batch, BATCH_WINDOW_SECONDS)
+
+    def _generate_batch(self, prompts: list[str], params: list) -> list[list[str]]:
+        return generate_in_prefix_order(self.llm, prompts, params)
+
+    @modal.method()
+    def generate(
+        self,
+        prompts: list[str],
+        samples_per_prompt: int = 1,
+        temperature: float = 0.1,
+        top_p: float = 0.95,
+        max_tokens: int = 512,
+        stop: tuple[str, ...] = (),
+        include_stop_str_in_output: bool = False,
+        stop_at_suffix: bool = False,
+    ) -> dict:
+        """
+        Returns {"completions": [...], "timings": {...}, "trace": [...]}.
+        Timings report the one-off model load separately from this request's
+        latency, which includes waiting to share a batch with other requests.
+        """
+        with (
+            recording("model_server") as tracer,
+            span(
+                "generate_request",
+                prompts=len(prompts),
+                load_seconds=self.load_seconds,
+            ) as request,
+        ):
+            sampling_params = build_sampling_params(
+                prompts,
+                samples_per_prompt=samples_per_prompt,
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=max_tokens,
+                stop=stop,
+                include_stop_str_in_output=include_stop_str_in_output,
+                stop_at_suffix=stop_at_suffix,
+            )
+            completions = self.batcher.submit(prompts, sampling_params)
+        return {
+            "completions": completions,
+            "timings": {
+                "load_seconds": self.load_seconds,
+                "request_seconds": request.seconds,
+            },
+            "trace": tracer.collect(),
+        }
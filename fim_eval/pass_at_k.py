@@ -0,0 +1,108 @@
+from typing import List, NamedTuple, Sequence, Union
+
+import numpy as np
+
+# Upper bound on elements materialized per bootstrap batch.
+BOOTSTRAP_BATCH_ELEMENTS = 1 << 22
+
+
+class PassAtK(NamedTuple):
+    k: int
+    estimate: float
+    lower: float
+    upper: float
+
+
+def pass_at_k(
+    num_samples: Union[int, Sequence[int], np.ndarray],
+    num_correct: Union[Sequence[int], np.ndarray],
+    ks: Sequence[int],
+) -> np.ndarray:
+    """
+    Unbiased pass@k of each problem for every k at once, as a
+    (len(ks), num_problems) array. pass@k is undefined, and NaN, for a
+    problem with fewer than k samples.
+
+    1 - comb(n - c, k) / comb(n, k) is computed as
+    1 - exp(sum_{i=n-c+1}^{n} log(1 - k / i)), using a cumulative table of the
+    log terms so every (problem, k) pair is a single lookup.
+    """
+    num_correct = np.asarray(num_correct, dtype=np.int64)
+    num_samples = np.broadcast_to(
+        np.asarray(num_samples, dtype=np.int64), num_correct.shape
+    )
+    assert num_samples.shape == num_correct.shape
+    ks_arr = np.asarray(ks, dtype=np.int64)[:, None]
+    num_failed = num_samples - num_correct
+
+    max_n = int(num_samples.max(initial=0))
+    i = np.arange(1, max_n + 1, dtype=np.float64)[None, :]
+    # Terms with i <= k never contribute because we only look up n - c >= k.
+    terms = np.where(i > ks_arr, np.log1p(-ks_arr / np.maximum(i, ks_arr + 1)), 0.0)
+    table = np.zeros((len(ks_arr), max_n + 1))
+    np.cumsum(terms, axis=1, out=table[:, 1:])
+
+    rows = np.arange(len(ks_arr))[:, None]
+    log_ratio = table[rows, num_samples[None, :]] - table[rows, num_failed[None, :]]
+    # Clamp the tiny positive log ratios cumsum round-off can produce.
+    estimate = np.maximum(-np.expm1(log_ratio), 0.0)
+    estimate = np.where(num_failed[None, :] < ks_arr, 1.0, estimate)
+    return np.where(num_samples[None, :] < ks_arr, np.nan, estimate)
+
+
+def estimate_pass_at_k(
+    num_samples: Union[int, List[int], np.ndarray],
+    num_correct: Union[List[int], np.ndarray],
+    k: int,
+) -> np.ndarray:
+    """
+    Estimates pass@k of each problem and returns them in an array.
+    """
+    return pass_at_k(num_samples, num_correct, [k])[0]
+
+
+def bootstrap_ci(
+    per_problem: np.ndarray,
+    num_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Percentile bootstrap over problems of the mean of each row of
+    `per_problem`, resampling in batches of index matrices.
+    """
+    num_ks, num_problems = per_problem.shape
+    rng = np.random.default_rng(seed)
+    batch = max(1, BOOTSTRAP_BATCH_ELEMENTS // max(1, num_ks * num_problems))
+
+    means = np.empty((num_ks, num_resamples))
+    for start in range(0, num_resamples, batch):
+        stop = min(start + batch, num_resamples)
+        idx = rng.integers(0, num_problems, size=(stop - start, num_problems))
+        means[:, start:stop] = per_problem[:, idx].mean(axis=2)
+
+    alpha = (1.0 - confidence) / 2
+    lower, upper = np.quantile(means, [alpha, 1.0 - alpha], axis=1)
+    return lower, upper
+
+
+def summarize_pass_at_k(
+    num_samples: Union[int, Sequence[int], np.ndarray],
+    num_correct: Union[Sequence[int], np.ndarray],
+    ks: Sequence[int],
+    num_resamples: int = 1000,
+    confidence: float = 0.95,
+    seed: int = 0,
+) -> list[PassAtK]:
+    """
+    Mean pass@k over problems with a bootstrap confidence interval, for each
+    k that every problem has enough samples for.
+    """
+    fewest = int(np.min(num_samples, initial=np.iinfo(np.int64).max))
+    ks = [k for k in ks if k <= fewest]
+    per_problem = pass_at_k(num_samples, num_correct, ks)
+    lower, upper = bootstrap_ci(per_problem, num_resamples, confidence, seed)
+    return [
+        PassAtK(k, float(per_problem[i].mean()), float(lower[i]), float(upper[i]))
+        for i, k in enumerate(ks)
+    ]
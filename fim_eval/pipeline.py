@@ -0,0 +1,406 @@
+"""
+The load -> generate -> write -> evaluate pipeline, independent of where
+generation runs. With the fake backend it runs end to end on a CPU box:
+
+    python -m fim_eval.pipeline --backend fake --seconds-per-prompt 0.01
+
+The other backends generate on Modal from this process, e.g.
+
+    python -m fim_eval.pipeline --backend vllm-server --model-name <model> --overlap
+
+With --overlap, completions are executed as generation batches come back
+instead of after the last one, and pass@k is reported as tasks finish.
+With --trace trace.json, the stages are written as a trace viewable in
+ui.perfetto.dev (see fim_eval.tracing).
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import queue
+import threading
+from collections import defaultdict
+from typing import Iterator, Optional
+
+from fim_eval.backends import GenerationBackend, SamplingConfig, get_backend
+from fim_eval.load_problems import Problem
+from fim_eval.profiles import (
+    PROFILES,
+    GenerationProfile,
+    get_profile,
+    sampling_config,
+    truncate_completion,
+)
+from fim_eval.prompts import construct_prompt
+from fim_eval.records import ResultRecord
+from fim_eval.tracing import TRACER, enable, span
+
+
+def make_results(
+    problems: list[Problem],
+    completions: list[list[str]],
+    profile: Optional[GenerationProfile] = None,
+) -> list[ResultRecord]:
+    """Results for the samples of each problem, truncated to `profile` if given."""
+    return [
+        ResultRecord(
+            problem.task_id,
+            (
+                truncate_completion(completion, problem.suffix, profile)
+                if profile is not None
+                else completion
+            ),
+            i,
+        )
+        for problem, samples in zip(problems, completions)
+        for i, completion in enumerate(samples)
+    ]
+
+
+def generate_results(
+    problems: list[Problem],
+    backend: GenerationBackend,
+    config: SamplingConfig,
+    profile: Optional[GenerationProfile] = None,
+) -> tuple[list[ResultRecord], dict[str, float]]:
+    with span("prompts", problems=len(problems)):
+        prompts = [construct_prompt(problem) for problem in problems]
+    generation = backend.generate(prompts, config)
+    with span("make_results"):
+        results = make_results(problems, generation.completions, profile)
+    return results, generation.timings
+
+
+def write_results(results: list[ResultRecord], path: str):
+    with span("result_write", results=len(results)), open(path, "w") as f:
+        for result in results:
+            line = json.dumps(result.model_dump())
+            f.write(line + "\n")
+
+
+def run_pipeline(
+    backend: GenerationBackend,
+    config: SamplingConfig,
+    problems: list[Problem],
+    results_path: str,
+    profile: Optional[GenerationProfile] = None,
+    run_dir: Optional[str] = None,
+    dataset_path: Optional[str] = None,
+    verdict_cache_path: Optional[str] = None,
+) -> dict[str, float]:
+    """
+    Runs every stage locally and returns the seconds spent in each. With
+    `run_dir`, generation is checkpointed there and resumes from it.
+    `dataset_path` keys the calibrated timeouts and `verdict_cache_path`
+    picks the verdict cache (defaults: the evaluator's).
+    """
+    from fim_eval import evaluate_fim_results as evaluation
+    from fim_eval.execution import ExecutionPool
+    from fim_eval.runs import assemble_results, run_generation
+    from fim_eval.timeouts import load_timeouts
+    from fim_eval.verdict_cache import DEFAULT_PATH as DEFAULT_VERDICT_CACHE
+    from fim_eval.verdict_cache import VerdictCache
+
+    timings: dict[str, float] = {}
+
+    if run_dir is not None:
+        model_name = getattr(backend, "model_name", None) or backend.name
+        with span("generation") as s:
+            timings.update(
+                run_generation(run_dir, problems, backend, config, model_name, profile)
+            )
+        timings["generation"] = s.seconds
+
+        with span("write") as s:
+            assemble_results(run_dir, problems, config.samples_per_prompt, results_path)
+        timings["write"] = s.seconds
+    else:
+        with span("generation") as s:
+            results, generation_timings = generate_results(
+                problems, backend, config, profile
+            )
+        timings.update(generation_timings)
+        timings["generation"] = s.seconds
+
+        with span("write") as s:
+            write_results(results, results_path)
+        timings["write"] = s.seconds
+
+    # Start from scratch so the evaluation stage is measured in full.
+    sidecar = evaluation.verdicts_path(results_path)
+    if os.path.exists(sidecar):
+        os.remove(sidecar)
+
+    problem_by_id = {problem.task_id: problem for problem in problems}
+    with (
+        span("evaluation") as s,
+        ExecutionPool(
+            evaluation.MAX_WORKERS, evaluation.MAX_JOBS_PER_WORKER, evaluation.LIMITS
+        ) as pool,
+        VerdictCache(verdict_cache_path or DEFAULT_VERDICT_CACHE) as cache,
+    ):
+        timeouts = load_timeouts(
+            dataset_path or evaluation.DATASET_PATH, problems, pool
+        )
+        evaluation.evaluate_results(results_path, problem_by_id, pool, timeouts, cache)
+    timings["evaluation"] = s.seconds
+
+    with span("aggregation") as s:
+        evaluation.score_results(sidecar)
+    timings["scoring"] = s.seconds
+
+    return timings
+
+
+# Prompts per generation batch, and how many finished batches may wait for
+# execution before generation is held back.
+OVERLAP_BATCH_SIZE = 32
+MAX_PENDING_BATCHES = 4
+
+
+class RunningPassAtK:
+    """pass@k over the tasks whose samples have all been evaluated so far."""
+
+    def __init__(self, samples_per_task: int, ks: list[int], num_tasks: int):
+        self.samples_per_task = samples_per_task
+        self.ks = [k for k in ks if k <= samples_per_task]
+        self.num_tasks = num_tasks
+        self.attempts: dict[str, int] = defaultdict(int)
+        self.successes: dict[str, int] = defaultdict(int)
+        self.num_correct: list[int] = []
+
+    def __call__(self, verdict: dict):
+        task_id = verdict["task_id"]
+        self.attempts[task_id] += 1
+        self.successes[task_id] += verdict["passed"]
+        if self.attempts[task_id] == self.samples_per_task:
+            self.num_correct.append(self.successes[task_id])
+
+    def report(self) -> str:
+        # numpy is not in the image that imports this module for Modal.
+        from fim_eval.pass_at_k import pass_at_k
+
+        if not self.num_correct or not self.ks:
+            return f"0 / {self.num_tasks} tasks scored"
+        estimates = pass_at_k(self.samples_per_task, self.num_correct, self.ks)
+        scores = ", ".join(
+            f"pass@{k}={estimate:.4f}"
+            for k, estimate in zip(self.ks, estimates.mean(axis=1))
+        )
+        return f"{len(self.num_correct)} / {self.num_tasks} tasks scored: {scores}"
+
+
+def iter_generated(
+    problems: list[Problem],
+    backend: GenerationBackend,
+    config: SamplingConfig,
+    batch_size: int,
+    max_pending_batches: int,
+    timings: dict[str, float],
+) -> Iterator[tuple[list[int], list[list[str]]]]:
+    """
+    Runs `backend.generate_batches` on a background thread and yields its
+    batches. The hand-off queue is bounded so generation stalls, rather than
+    piling up completions, when execution falls behind.
+    """
+    with span("prompts", problems=len(problems)):
+        prompts = [construct_prompt(problem) for problem in problems]
+    batches: queue.Queue = queue.Queue(maxsize=max_pending_batches)
+    done = object()
+
+    def produce():
+        try:
+            with span("generation") as s:
+                for batch in backend.generate_batches(prompts, config, batch_size):
+                    batches.put(batch)
+        except BaseException as e:
+            batches.put(e)
+        else:
+            timings["generation"] = s.seconds
+        batches.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while (batch := batches.get()) is not done:
+        if isinstance(batch, BaseException):
+            raise batch
+        yield batch
+
+
+def run_overlapped(
+    backend: GenerationBackend,
+    config: SamplingConfig,
+    problems: list[Problem],
+    results_path: str,
+    profile: Optional[GenerationProfile] = None,
+    batch_size: int = OVERLAP_BATCH_SIZE,
+    max_pending_batches: int = MAX_PENDING_BATCHES,
+    dataset_path: Optional[str] = None,
+) -> dict[str, float]:
+    """
+    `run_pipeline` with generation and execution overlapped: each batch of
+    completions is appended to `results_path` and handed to the execution
+    pool as soon as the backend returns it. Returns the seconds spent
+    generating (on its own thread), in total, and scoring.
+    """
+    from fim_eval import evaluate_fim_results as evaluation
+    from fim_eval.execution import ExecutionPool
+    from fim_eval.timeouts import load_timeouts
+    from fim_eval.verdict_cache import VerdictCache
+
+    timings: dict[str, float] = {}
+    sidecar = evaluation.verdicts_path(results_path)
+    if os.path.exists(sidecar):
+        os.remove(sidecar)
+
+    running = RunningPassAtK(config.samples_per_prompt, evaluation.K, len(problems))
+
+    def iter_samples(out) -> Iterator[tuple[int, ResultRecord]]:
+        completion_id = 0
+        for indices, completions in iter_generated(
+            problems, backend, config, batch_size, max_pending_batches, timings
+        ):
+            batch = make_results([problems[i] for i in indices], completions, profile)
+            with span("result_write", results=len(batch)):
+                for result in batch:
+                    out.write(json.dumps(result.model_dump()) + "\n")
+                out.flush()
+            for result in batch:
+                yield completion_id, result
+                completion_id += 1
+            print(running.report())
+
+    problem_by_id = {problem.task_id: problem for problem in problems}
+    with (
+        span("overlapped") as total,
+        ExecutionPool(
+            evaluation.MAX_WORKERS, evaluation.MAX_JOBS_PER_WORKER, evaluation.LIMITS
+        ) as pool,
+        VerdictCache() as cache,
+        open(results_path, "w") as out,
+    ):
+        timeouts = load_timeouts(
+            dataset_path or evaluation.DATASET_PATH, problems, pool
+        )
+        evaluation.evaluate_samples(
+            iter_samples(out),
+            results_path,
+            problem_by_id,
+            pool,
+            timeouts,
+            cache,
+            on_verdict=running,
+        )
+    print(running.report())
+    timings["total"] = total.seconds
+
+    with span("aggregation") as s:
+        evaluation.score_results(sidecar)
+    timings["scoring"] = s.seconds
+
+    return timings
+
+
+if __name__ == "__main__":
+    from fim_eval.datasets import DATASETS, DEFAULT_DATASET, Subset, get_dataset
+    from fim_eval.evaluate_fim_results import (
+        RESULTS_PATH,
+        dataset_file,
+        download_eval,
+        load_eval,
+    )
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="fake")
+    parser.add_argument(
+        "--model-name", default=None, help="required unless --backend fake"
+    )
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--dataset", choices=list(DATASETS), default=DEFAULT_DATASET)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--tasks", nargs="+", default=None, help="only these task ids")
+    parser.add_argument(
+        "--prefix", default=None, help="only task ids starting with this"
+    )
+    parser.add_argument(
+        "--sample", type=int, default=None, help="a stratified sample of this many"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--load-seconds", type=float, default=0.0)
+    parser.add_argument("--seconds-per-prompt", type=float, default=0.0)
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument(
+        "--profile", choices=list(PROFILES), default=None, help="default: the dataset's"
+    )
+    parser.add_argument("--max-tokens", type=int, default=None)
+    parser.add_argument("--results-path", default=RESULTS_PATH)
+    parser.add_argument("--overlap", action="store_true")
+    parser.add_argument(
+        "--run-dir", default=None, help="checkpoint generation here and resume from it"
+    )
+    parser.add_argument("--batch-size", type=int, default=OVERLAP_BATCH_SIZE)
+    parser.add_argument(
+        "--trace", default=None, help="write a Chrome/Perfetto trace of the run here"
+    )
+    args = parser.parse_args()
+    if args.trace:
+        enable()
+
+    download_eval(args.dataset)
+    subset = Subset(
+        tuple(args.tasks) if args.tasks else None, args.prefix, args.sample, args.seed
+    )
+    problems = load_eval(args.dataset, subset)[: args.limit]
+    if args.backend == "fake":
+        backend = get_backend(
+            "fake",
+            problems=problems,
+            load_seconds=args.load_seconds,
+            seconds_per_prompt=args.seconds_per_prompt,
+            num_shards=args.num_shards,
+        )
+        running = contextlib.nullcontext()
+    else:
+        if args.model_name is None:
+            parser.error(f"--model-name is required with the {args.backend} backend")
+        backend = get_backend(
+            args.backend, model_name=args.model_name, num_shards=args.num_shards
+        )
+        # The backends call Modal functions, which need a running app.
+        import fim_eval.model_server  # noqa: F401
+        import fim_eval.run_with_transformers  # noqa: F401
+        import fim_eval.run_with_vllm  # noqa: F401
+        from fim_eval.app import app
+
+        running = app.run()
+
+    profile = get_profile(args.profile or get_dataset(args.dataset).profile)
+    config = sampling_config(profile, problems, samples_per_prompt=args.samples)
+    if args.max_tokens is not None:
+        config.max_tokens = args.max_tokens
+    print(f"Sampling with {config}")
+    with running:
+        if args.overlap:
+            timings = run_overlapped(
+                backend,
+                config,
+                problems,
+                args.results_path,
+                profile,
+                args.batch_size,
+                dataset_path=dataset_file(args.dataset),
+            )
+        else:
+            timings = run_pipeline(
+                backend,
+                config,
+                problems,
+                args.results_path,
+                profile,
+                args.run_dir,
+                dataset_path=dataset_file(args.dataset),
+            )
+    print(json.dumps(timings, indent=2))
+    if args.trace:
+        TRACER.write(args.trace)
+        print(f"Wrote trace to {args.trace}")
@@ -0,0 +1,219 @@
+"""
+A columnar, memory-mapped cache of a problem dataset, so loading problems
+costs an mmap instead of decompressing and validating the whole gzip JSONL.
+
+The cache sits next to the dataset as `<dataset>.columns` and is rebuilt when
+the dataset's sha256 changes (mtimes do not survive copies between volumes). Layout, all integers little-endian u64:
+
+    magic | header length | JSON header | per field: offsets[n + 1], utf-8 data
+
+plus the rows sorted by task_id (for lookups by binary search). Every section
+is 8-byte aligned so offsets can be viewed in place.
+"""
+
+import bisect
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import TYPE_CHECKING, Iterator, Optional
+
+from fim_eval.records import ProblemRecord
+
+if TYPE_CHECKING:
+    from fim_eval.load_problems import Problem
+
+MAGIC = b"FIMCOL01"
+# Same fields, in the same order, as fim_eval.load_problems.Problem, whose
+# pydantic import is left to the code that validates or builds models.
+FIELDS = list(ProblemRecord._fields)
+
+
+def cache_path(dataset_path: str) -> str:
+    return dataset_path + ".columns"
+
+
+def source_stamp(dataset_path: str) -> str:
+    with open(dataset_path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def build_cache(dataset_path: str, path: str, stamp: str):
+    """Converts the gzip JSONL at `dataset_path` into a column file at `path`."""
+    from fim_eval.load_problems import Problem
+
+    columns: dict[str, list[bytes]] = {field: [] for field in FIELDS}
+    with gzip.open(dataset_path, "rb") as f:
+        for line in f:
+            # Validated once here, so reads from the cache need not be.
+            problem = Problem(**json.loads(line))
+            for field in FIELDS:
+                columns[field].append(getattr(problem, field).encode())
+    num_rows = len(columns["task_id"])
+    by_task_id = sorted(range(num_rows), key=columns["task_id"].__getitem__)
+
+    sections: list[bytes] = []
+    layout: dict[str, dict[str, int]] = {}
+    # Section positions are relative to the end of the header.
+    position = 0
+
+    def add(section: bytes) -> int:
+        nonlocal position
+        start = position
+        section += b"\0" * (-len(section) % 8)
+        sections.append(section)
+        position += len(section)
+        return start
+
+    for field in FIELDS:
+        offsets = [0]
+        for value in columns[field]:
+            offsets.append(offsets[-1] + len(value))
+        layout[field] = {
+            "offsets": add(struct.pack(f"<{num_rows + 1}Q", *offsets)),
+            "data": add(b"".join(columns[field])),
+        }
+    order = add(struct.pack(f"<{num_rows}Q", *by_task_id))
+
+    header = json.dumps(
+        {
+            "source": stamp,
+            "num_rows": num_rows,
+            "fields": layout,
+            "by_task_id": order,
+        }
+    ).encode()
+    header += b" " * (-len(header) % 8)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".")
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for section in sections:
+            f.write(section)
+    os.replace(tmp_path, path)
+
+
+class ProblemTable:
+    """Read-only view of a column file; rows are decoded only when read."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:8] != MAGIC:
+            raise ValueError(f"{path} is not a problem cache")
+        (header_length,) = struct.unpack_from("<Q", self._mmap, 8)
+        self.header = json.loads(self._mmap[16 : 16 + header_length])
+        self._base = 16 + header_length
+        self.num_rows: int = self.header["num_rows"]
+
+        view = memoryview(self._mmap)
+        self._offsets = {}
+        self._data = {}
+        for field, section in self.header["fields"].items():
+            start = self._base + section["offsets"]
+            self._offsets[field] = view[start : start + 8 * (self.num_rows + 1)].cast(
+                "Q"
+            )
+            self._data[field] = self._base + section["data"]
+        start = self._base + self.header["by_task_id"]
+        self._by_task_id = view[start : start + 8 * self.num_rows].cast("Q")
+
+    def field(self, row: int, name: str) -> str:
+        offsets = self._offsets[name]
+        start = self._data[name]
+        return self._mmap[start + offsets[row] : start + offsets[row + 1]].decode()
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __getitem__(self, row: int) -> "LazyProblem":
+        if not 0 <= row < self.num_rows:
+            raise IndexError(row)
+        return LazyProblem(self, row)
+
+    def __iter__(self) -> Iterator["LazyProblem"]:
+        return (LazyProblem(self, row) for row in range(self.num_rows))
+
+    def row_of(self, task_id: str) -> Optional[int]:
+        position = bisect.bisect_left(
+            range(self.num_rows),
+            task_id,
+            key=lambda i: self.field(self._by_task_id[i], "task_id"),
+        )
+        if position < self.num_rows:
+            row = self._by_task_id[position]
+            if self.field(row, "task_id") == task_id:
+                return row
+        return None
+
+    def get(self, task_id: str) -> Optional["LazyProblem"]:
+        row = self.row_of(task_id)
+        return None if row is None else LazyProblem(self, row)
+
+
+class LazyProblem:
+    """
+    Stands in for a `Problem` backed by a row of a ProblemTable: each field is
+    decoded from the mapped file on first access, and `model_dump` and
+    `to_problem` match the pydantic model.
+    """
+
+    __slots__ = ("_table", "_row", "_values")
+
+    def __init__(self, table: ProblemTable, row: int):
+        self._table = table
+        self._row = row
+        self._values: dict[str, str] = {}
+
+    def __getattr__(self, name: str) -> str:
+        if name not in FIELDS:
+            raise AttributeError(name)
+        if name not in self._values:
+            self._values[name] = self._table.field(self._row, name)
+        return self._values[name]
+
+    def model_dump(self) -> dict[str, str]:
+        return {field: getattr(self, field) for field in FIELDS}
+
+    def to_problem(self) -> "Problem":
+        from fim_eval.load_problems import Problem
+
+        return Problem.model_construct(**self.model_dump())
+
+    def __reduce__(self):
+        # The mapped table stays behind; other processes get a plain record.
+        return ProblemRecord, tuple(getattr(self, field) for field in FIELDS)
+
+    def __repr__(self) -> str:
+        return f"LazyProblem(task_id={self.task_id!r}, row={self._row})"
+
+
+def open_problems(dataset_path: str) -> ProblemTable:
+    """
+    The cached table for `dataset_path`, building the cache first if it is
+    missing or stale. Falls back to a temp dir when the dataset's directory
+    is not writable.
+    """
+    stamp = source_stamp(dataset_path)
+    candidates = [
+        cache_path(dataset_path),
+        os.path.join(tempfile.gettempdir(), os.path.basename(cache_path(dataset_path))),
+    ]
+    for path in candidates:
+        try:
+            table = ProblemTable(path)
+        except (OSError, ValueError):
+            pass
+        else:
+            if table.header["source"] == stamp:
+                return table
+    for path in candidates:
+        try:
+            build_cache(dataset_path, path, stamp)
+        except OSError:
+            continue
+        return ProblemTable(path)
+    raise OSError(f"Could not write a problem cache for {dataset_path}")
@@ -0,0 +1,131 @@
+"""
+Per-benchmark generation profiles: where decoding should stop, how many tokens
+it may take, and how completions are trimmed before they are executed.
+
+Single-line infilling fills exactly one line, so decoding stops at the first
+newline. Multi-line infilling stops where the model starts writing the suffix
+back out, which it tends to do once the hole is filled. Random-span holes
+start and end mid-line, so their completions are cut where the suffix's text
+is written back out whole, through the end of its first non-blank line,
+rather than at a line boundary: a fragment as short as `)` is often also the
+end of a correct completion.
+"""
+
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from fim_eval.backends import SamplingConfig
+from fim_eval.load_problems import Problem
+from fim_eval.sharding import estimate_tokens
+
+
+@dataclass(frozen=True)
+class GenerationProfile:
+    name: str
+    # Stop strings shared by every prompt.
+    stop: tuple[str, ...] = ()
+    # Keep the matched stop string, e.g. the newline that ends a single line.
+    include_stop_str_in_output: bool = False
+    # Also stop each prompt at the first line of its own suffix.
+    stop_at_suffix: bool = False
+    # Holes span whole lines: completions end in a newline, and the suffix is
+    # only recognised at the start of a line. Backends always stop that way.
+    whole_lines: bool = True
+    # Token budget as a multiple of the longest canonical solution.
+    token_margin: float = 2.0
+    min_tokens: int = 16
+
+
+SINGLE_LINE = GenerationProfile(
+    "single-line", stop=("\n",), include_stop_str_in_output=True
+)
+MULTI_LINE = GenerationProfile("multi-line", stop_at_suffix=True)
+RANDOM_SPAN = GenerationProfile("random-span", stop_at_suffix=True, whole_lines=False)
+
+PROFILES = {profile.name: profile for profile in (SINGLE_LINE, MULTI_LINE, RANDOM_SPAN)}
+
+
+def get_profile(name: str) -> GenerationProfile:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown profile {name!r}, expected one of {list(PROFILES)}")
+    return PROFILES[name]
+
+
+def token_budget(problems: list[Problem], profile: GenerationProfile) -> int:
+    longest = max(
+        (estimate_tokens(problem.canonical_solution) for problem in problems),
+        default=0,
+    )
+    return max(int(longest * profile.token_margin) + 1, profile.min_tokens)
+
+
+def sampling_config(
+    profile: GenerationProfile, problems: list[Problem], **overrides
+) -> SamplingConfig:
+    """A SamplingConfig with the profile's stops and a budget sized to `problems`."""
+    config = SamplingConfig(
+        max_tokens=token_budget(problems, profile),
+        stop=profile.stop,
+        include_stop_str_in_output=profile.include_stop_str_in_output,
+        stop_at_suffix=profile.stop_at_suffix,
+    )
+    return replace(config, **overrides)
+
+
+def suffix_stop(suffix: str) -> Optional[str]:
+    """The first non-blank line of `suffix`, as it would appear after a newline."""
+    for line in suffix.splitlines():
+        if line.strip():
+            return "\n" + line.rstrip()
+    return None
+
+
+def suffix_echo(suffix: str) -> Optional[str]:
+    """`suffix` through the end of its first non-blank line, newline included."""
+    end = 0
+    for line in suffix.splitlines(keepends=True):
+        end += len(line)
+        if line.strip():
+            return suffix[:end]
+    return None
+
+
+def stop_sequences(
+    stop: tuple[str, ...], stop_at_suffix: bool, suffix: str
+) -> list[str]:
+    """The stop strings for one prompt whose hole is followed by `suffix`."""
+    if stop_at_suffix and (line := suffix_stop(suffix)) is not None:
+        return [*stop, line]
+    return list(stop)
+
+
+def truncate_completion(
+    completion: str, suffix: str, profile: GenerationProfile
+) -> str:
+    """
+    Trims what a backend returned to what the profile asks for, in case it
+    did not stop by itself (stop strings unsupported, or a token that runs
+    past the stop). Whole-line completions end in a newline.
+    """
+    for stop in profile.stop:
+        position = completion.find(stop)
+        if position != -1:
+            if profile.include_stop_str_in_output:
+                position += len(stop)
+            completion = completion[:position]
+    if profile.stop_at_suffix and profile.whole_lines:
+        line = suffix_stop(suffix)
+        # The suffix line may also open the completion, without a newline.
+        if line is not None and ("\n" + completion).startswith(line):
+            return ""
+        position = completion.find(line) if line is not None else -1
+        if position != -1:
+            completion = completion[:position]
+    elif profile.stop_at_suffix:
+        echo = suffix_echo(suffix)
+        position = completion.find(echo) if echo is not None else -1
+        if position != -1:
+            completion = completion[:position]
+    if profile.whole_lines and completion and not completion.endswith("\n"):
+        completion += "\n"
+    return completion
@@ -0,0 +1,15 @@
+from fim_eval.load_problems import Problem
+
+FIM_BEGIN = "<｜fim▁begin｜>"
+FIM_HOLE = "<｜fim▁hole｜>"
+FIM_END = "<｜fim▁end｜>"
+
+
+def construct_prompt(problem: Problem) -> str:
+    return f"{FIM_BEGIN}{problem.prompt}{FIM_HOLE}{problem.suffix}{FIM_END}"
+
+
+def fim_suffix(prompt: str) -> str:
+    """The code after the hole in a prompt built by `construct_prompt`."""
+    _, _, rest = prompt.rpartition(FIM_HOLE)
+    return rest.removesuffix(FIM_END)
@@ -4,3 +4,5 @@ from pydantic import BaseModel
 class Result(BaseModel):
     task_id: str
     completion: str
+    # Which of the samples drawn for this task_id's prompt this is.
+    sample_index: int = 0
@@ -0,0 +1,421 @@
+"""
+An append-only store of completions from many runs, indexed for random
+access and filtered scans.
+
+Each ingest writes a new segment file under `segments/<run_id>/`, holding one
+record per completion (its JSON, zlib-compressed if the store compresses).
+Segments are never rewritten: ingesting a (run_id, task_id, sample_index)
+again appends a new record and repoints the index at it. The index is a
+sqlite table of (run_id, task_id, sample_index) -> segment, offset, length,
+plus the completion's position in its run and, once evaluated, its status.
+Lookups and scans read only the records they select.
+
+Results files written before samples were numbered have no sample_index;
+their completions are numbered by order of occurrence per task_id. A
+(task_id, sample_index) that appears twice in one ingest is rejected rather
+than letting the later line silently replace the earlier one.
+
+    python -m fim_eval.results_store ingest my-run data/results.jsonl --workers 4
+    python -m fim_eval.results_store show my-run --status failed
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional
+
+from fim_eval.records import ResultRecord
+from fim_eval.result import Result
+
+DEFAULT_ROOT = os.path.join(os.getcwd(), "data", "results_store")
+# Files smaller than this are ingested by one worker however many are asked for.
+MIN_INGEST_CHUNK_BYTES = 1 << 20
+
+# (task_id, sample_index, position, offset, length) for one record of a segment.
+# sample_index is None for a record without one until ingest numbers it.
+IndexRow = tuple[str, Optional[int], int, int, int]
+
+
+def encode_record(record: bytes, compress: bool) -> bytes:
+    return zlib.compress(record) if compress else record + b"\n"
+
+
+def decode_record(record: bytes, compressed: bool) -> ResultRecord:
+    # Validated on the way in, so read back without pydantic.
+    return ResultRecord(**json.loads(zlib.decompress(record) if compressed else record))
+
+
+def write_segment(
+    path: str,
+    records: Iterable[tuple[str, Optional[int], bytes]],
+    first_position: int,
+    compress: bool,
+) -> list[IndexRow]:
+    """Writes (task_id, sample_index, result JSON) records to a new segment."""
+    rows = []
+    offset = 0
+    with open(path, "wb") as f:
+        for position, (task_id, sample_index, record) in enumerate(
+            records, first_position
+        ):
+            record = encode_record(record, compress)
+            f.write(record)
+            rows.append((task_id, sample_index, position, offset, len(record)))
+            offset += len(record)
+    return rows
+
+
+def _ingest_range(
+    results_path: str, start: int, end: int, segment_path: str, compress: bool
+) -> list[IndexRow]:
+    """Writes the lines starting in [start, end) of a results file to a segment."""
+
+    def lines():
+        with open(results_path, "rb") as f:
+            f.seek(start)
+            if start > 0:
+                # The line straddling `start` belongs to the previous range.
+                f.seek(start - 1)
+                f.readline()
+            while f.tell() < end and (line := f.readline()):
+                line = line.strip()
+                if line:
+                    # Validated here, at the boundary, and then stored as is.
+                    result = Result.model_validate_json(line)
+                    sample_index = (
+                        result.sample_index
+                        if "sample_index" in result.model_fields_set
+                        else None
+                    )
+                    yield result.task_id, sample_index, line
+
+    # Positions and missing sample indices are numbered across ranges once all
+    # are in, see ResultsStore.ingest.
+    return write_segment(segment_path, lines(), 0, compress)
+
+
+def number_samples(rows: list[IndexRow], source: str) -> list[IndexRow]:
+    """
+    Gives rows without a sample_index the next one for their task_id, in
+    order, and raises ValueError if a (task_id, sample_index) repeats.
+    """
+    occurrences: dict[str, int] = {}
+    seen: set[tuple[str, int]] = set()
+    numbered = []
+    for task_id, sample_index, position, offset, length in rows:
+        if sample_index is None:
+            sample_index = occurrences.get(task_id, 0)
+            occurrences[task_id] = sample_index + 1
+        if (task_id, sample_index) in seen:
+            raise ValueError(
+                f"{task_id} sample {sample_index} appears more than once in {source}"
+            )
+        seen.add((task_id, sample_index))
+        numbered.append((task_id, sample_index, position, offset, length))
+    return numbered
+
+
+class ResultsStore:
+    """
+    Completions of any number of runs, stored under `root`. Safe to share
+    between threads; `compress` applies to segments written from then on.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT, compress: bool = False):
+        self.root = root
+        self.compress = compress
+        os.makedirs(os.path.join(root, "segments"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), check_same_thread=False
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS segments ("
+            " id INTEGER PRIMARY KEY,"
+            " run_id TEXT NOT NULL,"
+            " path TEXT NOT NULL,"
+            " compressed INTEGER NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " run_id TEXT NOT NULL,"
+            " task_id TEXT NOT NULL,"
+            " sample_index INTEGER NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " segment INTEGER NOT NULL,"
+            " offset INTEGER NOT NULL,"
+            " length INTEGER NOT NULL,"
+            " status TEXT,"
+            " PRIMARY KEY (run_id, task_id, sample_index))"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS results_position ON results (run_id, position)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS results_status ON results (run_id, status)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS results_task ON results (task_id)")
+        self._segments: dict[int, tuple[str, bool]] = {
+            id: (path, bool(compressed))
+            for id, path, compressed in self._db.execute(
+                "SELECT id, path, compressed FROM segments"
+            )
+        }
+
+    def _new_segment_path(self, run_id: str) -> str:
+        run_dir = os.path.join(self.root, "segments", run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        existing = [name for name in os.listdir(run_dir) if name.endswith(".seg")]
+        return os.path.join(run_dir, f"{len(existing):06d}.seg")
+
+    def _index_segment(self, run_id: str, path: str, rows: list[IndexRow]):
+        """Registers a written segment and points the index at its records."""
+        relative_path = os.path.relpath(path, self.root)
+        cursor = self._db.execute(
+            "INSERT INTO segments (run_id, path, compressed) VALUES (?, ?, ?)",
+            (run_id, relative_path, int(self.compress)),
+        )
+        segment = cursor.lastrowid
+        self._segments[segment] = (relative_path, self.compress)
+        self._db.executemany(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, NULL)",
+            [
+                (run_id, task_id, sample_index, position, segment, offset, length)
+                for task_id, sample_index, position, offset, length in rows
+            ],
+        )
+
+    def _next_position(self, run_id: str) -> int:
+        (position,) = self._db.execute(
+            "SELECT COALESCE(MAX(position) + 1, 0) FROM results WHERE run_id = ?",
+            (run_id,),
+        ).fetchone()
+        return position
+
+    def append(self, run_id: str, results: Iterable[ResultRecord]) -> int:
+        """Adds `results` to the run as one new segment; returns how many."""
+        with self._lock:
+            path = self._new_segment_path(run_id)
+            rows = write_segment(
+                path,
+                (
+                    (
+                        result.task_id,
+                        result.sample_index,
+                        json.dumps(result.model_dump()).encode(),
+                    )
+                    for result in results
+                ),
+                self._next_position(run_id),
+                self.compress,
+            )
+            try:
+                rows = number_samples(rows, "the appended results")
+            except ValueError:
+                os.remove(path)
+                raise
+            self._index_segment(run_id, path, rows)
+            self._db.commit()
+        return len(rows)
+
+    def ingest(self, run_id: str, results_path: str, workers: int = 1) -> int:
+        """
+        Makes a results file the contents of the run, replacing what the index
+        held for it (earlier segments stay on disk), and returns how many
+        completions it holds. Positions are the line numbers, as the evaluator
+        numbers completions. With `workers` > 1 the file is split into byte
+        ranges that are parsed and written to their own segments in parallel
+        processes.
+        """
+        size = os.path.getsize(results_path)
+        num_ranges = max(1, min(workers, size // MIN_INGEST_CHUNK_BYTES))
+        bounds = [size * i // num_ranges for i in range(num_ranges + 1)]
+
+        with self._lock:
+            paths = []
+            for _ in range(num_ranges):
+                # Reserve the name so the next range does not reuse it.
+                paths.append(self._new_segment_path(run_id))
+                open(paths[-1], "wb").close()
+
+            args = [
+                (results_path, bounds[i], bounds[i + 1], paths[i], self.compress)
+                for i in range(num_ranges)
+            ]
+            if num_ranges == 1:
+                range_rows = [_ingest_range(*args[0])]
+            else:
+                with ProcessPoolExecutor(num_ranges) as executor:
+                    range_rows = list(executor.map(_ingest_range, *zip(*args)))
+
+            rows = [
+                (task_id, sample_index, position, offset, length)
+                for position, (task_id, sample_index, _, offset, length) in enumerate(
+                    row for rows in range_rows for row in rows
+                )
+            ]
+            try:
+                rows = number_samples(rows, results_path)
+            except ValueError:
+                for path in paths:
+                    os.remove(path)
+                raise
+
+            self._db.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+            start = 0
+            for path, segment_rows in zip(paths, range_rows):
+                self._index_segment(
+                    run_id, path, rows[start : start + len(segment_rows)]
+                )
+                start += len(segment_rows)
+            self._db.commit()
+        return len(rows)
+
+    def record_verdicts(self, run_id: str, verdicts: Iterable[Dict]):
+        """
+        Stores each verdict's status against the completion it judged. A
+        verdict's completion_id is the completion's line in the results file,
+        which is its position when the run was ingested from that file.
+        """
+        with self._lock:
+            self._db.executemany(
+                "UPDATE results SET status = ? WHERE run_id = ? AND position = ?",
+                (
+                    (verdict["status"], run_id, verdict["completion_id"])
+                    for verdict in verdicts
+                ),
+            )
+            self._db.commit()
+
+    def _read(self, rows: Iterable[tuple]) -> Iterator[tuple[str, ResultRecord]]:
+        """
+        Yields (run_id, result) for (run_id, sample_index, segment, offset,
+        length) rows. The index's sample_index wins over the record's, which
+        is missing from records of old results files.
+        """
+        files: dict[int, int] = {}
+        try:
+            for run_id, sample_index, segment, offset, length in rows:
+                path, compressed = self._segments[segment]
+                if segment not in files:
+                    files[segment] = os.open(os.path.join(self.root, path), os.O_RDONLY)
+                record = os.pread(files[segment], length, offset)
+                result = decode_record(record, compressed)
+                yield run_id, result._replace(sample_index=sample_index)
+        finally:
+            for fd in files.values():
+                os.close(fd)
+
+    def get(
+        self, run_id: str, task_id: str, sample_index: int
+    ) -> Optional[ResultRecord]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT run_id, sample_index, segment, offset, length FROM results"
+                " WHERE run_id = ? AND task_id = ? AND sample_index = ?",
+                (run_id, task_id, sample_index),
+            ).fetchall()
+        return next((result for _, result in self._read(rows)), None)
+
+    def scan(
+        self,
+        run_id: Optional[str] = None,
+        task_id: Optional[str] = None,
+        status: Optional[str] = None,
+    ) -> Iterator[tuple[str, ResultRecord]]:
+        """
+        Yields (run_id, result) for every stored completion matching all the
+        given filters, by run and then position in the run.
+        """
+        filters = {"run_id": run_id, "task_id": task_id, "status": status}
+        where = [f"{column} = ?" for column, value in filters.items() if value]
+        query = "SELECT run_id, sample_index, segment, offset, length FROM results"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY run_id, position"
+        with self._lock:
+            rows = self._db.execute(
+                query, [value for value in filters.values() if value]
+            ).fetchall()
+        return self._read(rows)
+
+    def export(self, run_id: str, path: str) -> int:
+        """Writes a run back out as a results.jsonl, e.g. to evaluate it."""
+        count = 0
+        with open(path, "w") as f:
+            for _, result in self.scan(run_id):
+                f.write(json.dumps(result.model_dump()) + "\n")
+                count += 1
+        return count
+
+    def runs(self) -> dict[str, dict[str, int]]:
+        """run_id -> number of completions stored, by status."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT run_id, COALESCE(status, 'unevaluated'), COUNT(*)"
+                " FROM results GROUP BY run_id, status ORDER BY run_id"
+            ).fetchall()
+        runs: dict[str, dict[str, int]] = {}
+        for run_id, status, count in rows:
+            runs.setdefault(run_id, {})[status] = count
+        return runs
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> "ResultsStore":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=DEFAULT_ROOT)
+    parser.add_argument("--compress", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="add a results file as a run")
+    ingest.add_argument("run_id")
+    ingest.add_argument("results_path")
+    ingest.add_argument("--verdicts", help="also record statuses from this file")
+    ingest.add_argument("--workers", type=int, default=os.cpu_count())
+
+    show = commands.add_parser("show", help="print stored completions")
+    show.add_argument("run_id", nargs="?")
+    show.add_argument("--task-id")
+    show.add_argument("--status")
+
+    export = commands.add_parser("export", help="write a run as a results file")
+    export.add_argument("run_id")
+    export.add_argument("path")
+
+    commands.add_parser("runs", help="list runs and their statuses")
+    args = parser.parse_args()
+
+    with ResultsStore(args.root, args.compress) as store:
+        if args.command == "ingest":
+            try:
+                count = store.ingest(args.run_id, args.results_path, args.workers)
+            except ValueError as e:
+                raise SystemExit(f"Not ingested: {e}")
+            print(f"Ingested {count} completions into {args.run_id}")
+            if args.verdicts:
+                from fim_eval.evaluate_fim_results import iter_verdicts
+
+                store.record_verdicts(args.run_id, iter_verdicts(args.verdicts))
+        elif args.command == "show":
+            for run_id, result in store.scan(args.run_id, args.task_id, args.status):
+                print(json.dumps({"run_id": run_id, **result.model_dump()}))
+        elif args.command == "export":
+            print(f"Wrote {store.export(args.run_id, args.path)} completions")
+        else:
+            print(json.dumps(store.runs(), indent=2))
@@ -1,8 +1,9 @@
-import time
-
 import modal
 from fim_eval.constants import MODEL_VOLUME, MODELS_DIR
 from fim_eval.app import app
+from fim_eval.tracing import recording, span
+
+BATCH_SIZE = 16
 
 volume = modal.Volume.from_name(MODEL_VOLUME, create_if_missing=True)
 
@@ -18,34 +19,110 @@ with image.imports():
     gpu=modal.gpu.L4(count=1),
     volumes={MODELS_DIR: volume},
 )
-def run_with_transformers(model_name: str, prompts: list[str]) -> list[str]:
-    print(f"Running {model_name}")
-    t0 = time.time()
+def run_with_transformers(
+    model_name: str,
+    prompts: list[str],
+    samples_per_prompt: int = 1,
+    temperature: float = 0.1,
+    top_p: float = 0.95,
+    max_tokens: int = 512,
+    batch_size: int = BATCH_SIZE,
+    stop: tuple[str, ...] = (),
+    include_stop_str_in_output: bool = False,
+    stop_at_suffix: bool = False,
+) -> dict:
+    """
+    Returns {"completions": [...], "trace": [...]}: `samples_per_prompt`
+    completions for each prompt, in prompt order, and the spans recorded here.
 
+    Prompts are sorted by token length and generated `batch_size` at a time, so
+    each batch pads to a similar length, with all samples of a prompt drawn
+    in the same `generate` call.
+
+    Rows stop at the shared `stop` strings. Per-prompt suffix stops are left to
+    the truncation in the results path, as is dropping the stop string when
+    `include_stop_str_in_output` is off.
+    """
+    print(f"Running {model_name}")
     num_prompts = len(prompts)
-    print(f"Running {num_prompts} prompts")
+    print(f"Running {num_prompts} prompts x {samples_per_prompt} samples")
+
+    with (
+        recording("run_with_transformers") as tracer,
+        span("run_with_transformers", model=model_name, prompts=num_prompts) as total,
+    ):
+        completions = _generate(
+            model_name,
+            prompts,
+            samples_per_prompt,
+            temperature,
+            top_p,
+            max_tokens,
+            batch_size,
+            stop,
+        )
+    print(f"Total time taken to run {model_name}: {total.seconds} seconds")
 
+    return {"completions": completions, "trace": tracer.collect()}
+
+
+def _generate(
+    model_name: str,
+    prompts: list[str],
+    samples_per_prompt: int,
+    temperature: float,
+    top_p: float,
+    max_tokens: int,
+    batch_size: int,
+    stop: tuple[str, ...],
+) -> list[list[str]]:
+    num_prompts = len(prompts)
     model_path = MODELS_DIR + "/" + model_name
-    tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
-    t1 = time.time()
-    print(f"Tokenizer loaded in {t1 - t0} seconds")
-
-    model = AutoModelForCausalLM.from_pretrained(
-        model_path, trust_remote_code=True
-    ).cuda()
-    t2 = time.time()
-    print(f"Model loaded in {t2 - t1} seconds")
-
-    completions = []
-    for i, p in enumerate(prompts):
-        inputs = tokenizer(p, return_tensors="pt").to(model.device)
-        outputs = model.generate(**inputs, max_length=512, temperature=0.1, top_p=0.95)
-        decoded_output = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        completion = decoded_output[len(p) :]
-        print(f"Completion [{i}/{num_prompts}]: ===\n{completion}\n===")
-        completions.append(completion)
-
-    t4 = time.time()
-    print(f"Total time taken to run {model_name}: {t4 - t0} seconds")
+    with span("tokenizer_load") as load:
+        # Left padding lines up the last prompt token of every row, so
+        # generation continues each prompt directly.
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_path, trust_remote_code=True, padding_side="left"
+        )
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+    print(f"Tokenizer loaded in {load.seconds} seconds")
+
+    with span("model_load") as load:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path, trust_remote_code=True
+        ).cuda()
+    print(f"Model loaded in {load.seconds} seconds")
+
+    lengths = [len(ids) for ids in tokenizer(prompts)["input_ids"]]
+    order = sorted(range(num_prompts), key=lengths.__getitem__)
+
+    completions: list[list[str]] = [[] for _ in prompts]
+    for start in range(0, num_prompts, batch_size):
+        bucket = order[start : start + batch_size]
+        inputs = tokenizer(
+            [prompts[i] for i in bucket], return_tensors="pt", padding=True
+        ).to(model.device)
+        with span("generation", prompts=len(bucket)):
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                do_sample=True,
+                temperature=temperature,
+                top_p=top_p,
+                num_return_sequences=samples_per_prompt,
+                pad_token_id=tokenizer.pad_token_id,
+                stop_strings=list(stop) or None,
+                tokenizer=tokenizer,
+            )
+        # Rows come back grouped by prompt, samples_per_prompt rows each.
+        decoded = tokenizer.batch_decode(
+            outputs[:, inputs["input_ids"].shape[1] :], skip_special_tokens=True
+        )
+        for j, i in enumerate(bucket):
+            completions[i] = decoded[
+                j * samples_per_prompt : (j + 1) * samples_per_prompt
+            ]
+        print(f"Completed [{start + len(bucket)}/{num_prompts}] prompts")
 
     return completions
@@ -1,9 +1,10 @@
-import time
-
 import modal
 
 from fim_eval.constants import MODEL_VOLUME, MODELS_DIR
 from fim_eval.app import app
+from fim_eval.profiles import stop_sequences
+from fim_eval.prompts import fim_suffix
+from fim_eval.tracing import recording, span
 
 volume = modal.Volume.from_name(MODEL_VOLUME, create_if_missing=True)
 
@@ -21,25 +22,91 @@ with image.imports():
     volumes={MODELS_DIR: volume},
     timeout=1200,
 )
-def run_with_vllm(model_name: str, prompts: list[str]):
+def run_with_vllm(
+    model_name: str,
+    prompts: list[str],
+    samples_per_prompt: int = 1,
+    temperature: float = 0.1,
+    top_p: float = 0.95,
+    max_tokens: int = 512,
+    stop: tuple[str, ...] = (),
+    include_stop_str_in_output: bool = False,
+    stop_at_suffix: bool = False,
+) -> dict:
+    """
+    Returns {"completions": [...], "trace": [...]}: `samples_per_prompt`
+    completions for each prompt, in prompt order, and the spans recorded here
+    (see fim_eval.tracing). Each unique prompt is prefilled once and sampled n
+    times, until one of the stop strings (see fim_eval.profiles) or
+    `max_tokens`.
+    """
     print(f"Running {model_name}")
-    t0 = time.time()
-
     num_prompts = len(prompts)
-    print(f"Running {num_prompts} prompts")
+    print(f"Running {num_prompts} prompts x {samples_per_prompt} samples")
+
+    with (
+        recording("run_with_vllm") as tracer,
+        span("run_with_vllm", model=model_name, prompts=num_prompts) as total,
+    ):
+        sampling_params = build_sampling_params(
+            prompts,
+            samples_per_prompt=samples_per_prompt,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            stop=stop,
+            include_stop_str_in_output=include_stop_str_in_output,
+            stop_at_suffix=stop_at_suffix,
+        )
+        model_path = MODELS_DIR + "/" + model_name
+        with span("model_load") as load:
+            llm = LLM(
+                model=model_path, trust_remote_code=True, enable_prefix_caching=True
+            )
+        print(f"Model loaded in {load.seconds} seconds")
+
+        completions = generate_in_prefix_order(llm, prompts, sampling_params)
+    print(f"Total time taken to run {model_name}: {total.seconds} seconds")
+
+    return {"completions": completions, "trace": tracer.collect()}
 
-    sampling_params = SamplingParams(temperature=0.1, top_p=0.95, max_tokens=512)
-    model_path = MODELS_DIR + "/" + model_name
-    llm = LLM(model=model_path, trust_remote_code=True)
-    t1 = time.time()
-    print(f"Model loaded in {t1 - t0} seconds")
 
-    outputs = llm.generate(prompts, sampling_params)
+def build_sampling_params(
+    prompts: list[str],
+    stop: tuple[str, ...],
+    stop_at_suffix: bool,
+    **kwargs,
+) -> list:
+    """
+    One SamplingParams per prompt, so each can stop at its own suffix.
+    `kwargs` are passed through, with `samples_per_prompt` as `n`.
+    """
+    kwargs["n"] = kwargs.pop("samples_per_prompt")
+    return [
+        SamplingParams(
+            stop=stop_sequences(stop, stop_at_suffix, fim_suffix(prompt)), **kwargs
+        )
+        for prompt in prompts
+    ]
 
-    t2 = time.time()
-    print(f"Inference complete in {t2 - t1} seconds")
 
-    t3 = time.time()
-    print(f"Total time taken to run {model_name}: {t3 - t0} seconds")
+def generate_in_prefix_order(
+    llm, prompts: list[str], sampling_params
+) -> list[list[str]]:
+    """
+    Generates with `sampling_params` (one, or a list with one per prompt) and
+    returns the samples for each prompt in the original order.
+    """
+    # Sorting places prompts that share a prefix (e.g. infilling holes in the
+    # same function) next to each other, so prefix caching reuses their blocks.
+    order = sorted(range(len(prompts)), key=prompts.__getitem__)
+    if isinstance(sampling_params, list):
+        sampling_params = [sampling_params[i] for i in order]
+    with span("generation", prompts=len(prompts)) as s:
+        outputs = llm.generate([prompts[i] for i in order], sampling_params)
+    print(f"Inference complete in {s.seconds} seconds")
 
-    return [o.outputs[0].text for o in outputs]
+    completions: list[list[str]] = [[] for _ in prompts]
+    for i, output in zip(order, outputs):
+        completions[i] = [sample.text for sample in output.outputs]
+    return completions
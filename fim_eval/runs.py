@@ -0,0 +1,201 @@
+"""
+Checkpointed generation runs, so a run that is cut short (timeout,
+preemption) can be restarted without losing finished work.
+
+A run lives in `<runs dir>/<run_id>/`: a `manifest.json` with the settings
+and model revision it was started with, and one
+`shard-<attempt>-<batch>.results` per finished generation batch, in the
+packed format of fim_eval.records. Shards are written whole (via a rename),
+so a killed run never leaves a partial one. On restart the finished
+(task_id, sample_index) pairs are read back from the shards and only the
+missing samples are generated. `assemble_results` merges the shards into a
+single results file in problem order.
+
+The run id is derived from the settings and model revision unless one is
+given, so naming a new run is how to regenerate with unchanged settings.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import time
+from dataclasses import asdict
+from typing import Callable, Iterator, Optional
+
+from fim_eval.backends import GenerationBackend, SamplingConfig
+from fim_eval.load_problems import Problem
+from fim_eval.pipeline import make_results
+from fim_eval.profiles import GenerationProfile
+from fim_eval.prompts import construct_prompt
+from fim_eval.records import ResultRecord, read_packed, write_packed
+from fim_eval.tracing import span
+
+# Prompts per shard. Smaller loses less on interruption, larger makes fewer files.
+SHARD_SIZE = 64
+
+
+def run_id(
+    model_name: str,
+    model_revision: Optional[str],
+    config: SamplingConfig,
+    problems: list[Problem],
+) -> str:
+    """
+    Derived from the run's settings and the revision of the weights, so
+    restarting the same run finds it and new weights start a new one.
+    """
+    key = json.dumps(
+        [
+            model_name,
+            model_revision,
+            asdict(config),
+            [problem.task_id for problem in problems],
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def start_run(
+    run_dir: str,
+    model_name: str,
+    config: SamplingConfig,
+    problems: list[Problem],
+    model_revision: Optional[str] = None,
+) -> dict:
+    """Creates the run's manifest, or records another attempt at an existing run."""
+    path = os.path.join(run_dir, "manifest.json")
+    settings = {
+        "model_name": model_name,
+        "model_revision": model_revision,
+        "config": asdict(config),
+        "task_ids": [problem.task_id for problem in problems],
+    }
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        # json has no tuples; compare the way the manifest stores settings.
+        if manifest["settings"] != json.loads(json.dumps(settings)):
+            raise ValueError(f"{run_dir} was started with different settings")
+    else:
+        os.makedirs(run_dir, exist_ok=True)
+        manifest = {"settings": settings, "attempts": []}
+    manifest["attempts"].append({"started": time.time()})
+
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return manifest
+
+
+def iter_shard_results(run_dir: str) -> Iterator[ResultRecord]:
+    for path in sorted(glob.glob(os.path.join(run_dir, "shard-*.results"))):
+        yield from read_packed(path)
+
+
+def write_shard(run_dir: str, name: str, results: list[ResultRecord]):
+    path = os.path.join(run_dir, name)
+    write_packed(path + ".tmp", results)
+    os.replace(path + ".tmp", path)
+
+
+def missing_samples(
+    run_dir: str, problems: list[Problem], samples_per_prompt: int
+) -> dict[int, list[int]]:
+    """Problem index -> the sample indices no shard has yet."""
+    done = {
+        (result.task_id, result.sample_index) for result in iter_shard_results(run_dir)
+    }
+    missing = {}
+    for i, problem in enumerate(problems):
+        indices = [
+            j for j in range(samples_per_prompt) if (problem.task_id, j) not in done
+        ]
+        if indices:
+            missing[i] = indices
+    return missing
+
+
+def run_generation(
+    run_dir: str,
+    problems: list[Problem],
+    backend: GenerationBackend,
+    config: SamplingConfig,
+    model_name: str,
+    profile: Optional[GenerationProfile] = None,
+    shard_size: int = SHARD_SIZE,
+    on_shard: Optional[Callable[[], None]] = None,
+    model_revision: Optional[str] = None,
+) -> dict[str, float]:
+    """
+    Generates whatever the run in `run_dir` is missing in batches of
+    `shard_size` prompts, writing a shard file per finished batch and calling
+    `on_shard` after each (e.g. to commit a volume). Backends that run on
+    containers generate up to `num_shards` batches at a time (see
+    GenerationBackend.generate_batches), and a batch is saved as soon as it
+    returns, so a timeout loses at most the batches in flight. Returns
+    generation timings.
+    """
+    manifest = start_run(run_dir, model_name, config, problems, model_revision)
+    attempt = len(manifest["attempts"]) - 1
+
+    t0 = time.time()
+    missing = missing_samples(run_dir, problems, config.samples_per_prompt)
+    num_missing = sum(len(indices) for indices in missing.values())
+    print(
+        f"Run {run_dir}, attempt {attempt}:"
+        f" {num_missing} samples of {len(missing)} problems left to generate"
+    )
+
+    # Problems missing only some samples are regenerated in full, and just the
+    # missing sample indices are kept.
+    pending = list(missing)
+    prompts = [construct_prompt(problems[i]) for i in pending]
+    batches = backend.generate_batches(prompts, config, shard_size)
+    for batch, (indices, completions) in enumerate(batches):
+        batch_problems = [problems[pending[i]] for i in indices]
+        wanted = {
+            (problems[pending[i]].task_id, j)
+            for i in indices
+            for j in missing[pending[i]]
+        }
+        results = [
+            result
+            for result in make_results(batch_problems, completions, profile)
+            if (result.task_id, result.sample_index) in wanted
+        ]
+        with span("result_write", shard=batch, results=len(results)):
+            write_shard(run_dir, f"shard-{attempt:03d}-{batch:05d}.results", results)
+            if on_shard is not None:
+                on_shard()
+        print(f"Wrote shard {batch} ({len(results)} samples)")
+
+    return {"generation": time.time() - t0, "generated_samples": num_missing}
+
+
+def assemble_results(
+    run_dir: str, problems: list[Problem], samples_per_prompt: int, path: str
+) -> list[ResultRecord]:
+    """
+    Writes the run's results to `path`, one per (task_id, sample_index) in
+    problem order, and returns them. Fails if the run is incomplete.
+    """
+    by_key = {
+        (result.task_id, result.sample_index): result
+        for result in iter_shard_results(run_dir)
+    }
+    results = []
+    for problem in problems:
+        for j in range(samples_per_prompt):
+            if (problem.task_id, j) not in by_key:
+                raise ValueError(
+                    f"{run_dir} is missing sample {j} of {problem.task_id}"
+                )
+            results.append(by_key[problem.task_id, j])
+
+    with span("result_write", results=len(results)), open(path + ".tmp", "w") as f:
+        for result in results:
+            f.write(json.dumps(result.model_dump()) + "\n")
+    os.replace(path + ".tmp", path)
+    return results
@@ -0,0 +1,124 @@
+"""
+Splits a prompt set into shards balanced by estimated token count, runs a
+bounded number of shards in parallel and merges the completions back in
+prompt order.
+"""
+
+import contextvars
+import math
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import accumulate
+from typing import Callable, Iterator, Optional
+
+from fim_eval.tracing import merge
+
+# Runs one shard (a list of prompts) and returns the completions of each prompt.
+ShardRunner = Callable[[list[str]], list[list[str]]]
+
+CHARS_PER_TOKEN = 4
+MAX_ATTEMPTS = 3
+
+
+def estimate_tokens(prompt: str) -> int:
+    return len(prompt) // CHARS_PER_TOKEN + 1
+
+
+def shard_prompts(prompts: list[str], num_shards: int) -> list[list[int]]:
+    """
+    Partitions prompt indices into at most `num_shards` shards of roughly
+    equal estimated token count.
+
+    Prompts are sorted first and each shard takes a contiguous run, so prompts
+    sharing a prefix land in the same shard and keep their prefix cache hits.
+    """
+    order = sorted(range(len(prompts)), key=prompts.__getitem__)
+    cumulative = list(accumulate(estimate_tokens(prompts[i]) for i in order))
+    total = cumulative[-1] if cumulative else 0
+
+    shards: list[list[int]] = [[] for _ in range(num_shards)]
+    for position, i in enumerate(order):
+        # Place each prompt by the midpoint of its token span.
+        midpoint = cumulative[position] - estimate_tokens(prompts[i]) / 2
+        shards[min(int(midpoint * num_shards / total), num_shards - 1)].append(i)
+    return [shard for shard in shards if shard]
+
+
+def iter_sharded(
+    prompts: list[str],
+    num_shards: int,
+    run_shard: ShardRunner,
+    max_attempts: int = MAX_ATTEMPTS,
+    shard_size: Optional[int] = None,
+) -> Iterator[tuple[list[int], list[list[str]]]]:
+    """
+    Splits the prompts into `num_shards` shards, or into shards of about
+    `shard_size` prompts if given, runs at most `num_shards` of them at a time
+    through `run_shard` and yields (prompt indices, completions) for each
+    shard as it finishes. A shard that fails is retried on its own, up to
+    `max_attempts` runs in total.
+    """
+    if not prompts:
+        return
+    count = num_shards if shard_size is None else math.ceil(len(prompts) / shard_size)
+    shards = shard_prompts(prompts, count)
+    print(
+        f"Running {len(prompts)} prompts in {len(shards)} shards of "
+        f"{[len(shard) for shard in shards]} prompts, {num_shards} at a time"
+    )
+
+    executor = ThreadPoolExecutor(num_shards)
+    attempts = [1] * len(shards)
+
+    def submit(s: int) -> Future:
+        # Runs in the caller's context so spans the shard merges land in its trace.
+        shard = [prompts[i] for i in shards[s]]
+        return executor.submit(contextvars.copy_context().run, run_shard, shard)
+
+    running = {submit(s): s for s in range(len(shards))}
+    try:
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                s = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield shards[s], future.result()
+                    continue
+                print(f"Shard {s} failed on attempt {attempts[s]}: {error!r}")
+                if attempts[s] == max_attempts:
+                    raise RuntimeError(
+                        f"Shard {s} failed after {max_attempts} attempts"
+                    ) from error
+                attempts[s] += 1
+                running[submit(s)] = s
+    finally:
+        # Shards still queued are dropped if the caller stops early or one fails.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_sharded(
+    prompts: list[str],
+    num_shards: int,
+    run_shard: ShardRunner,
+    max_attempts: int = MAX_ATTEMPTS,
+) -> list[list[str]]:
+    """`iter_sharded`, returning the completions for each prompt in order."""
+    completions: list[list[str]] = [[] for _ in prompts]
+    for shard, outputs in iter_sharded(prompts, num_shards, run_shard, max_attempts):
+        for i, samples in zip(shard, outputs):
+            completions[i] = samples
+    return completions
+
+
+def modal_runner(function, model_name: str, **kwargs) -> ShardRunner:
+    """
+    Runs a shard in a container of a Modal generation function, merging the
+    spans the container returns into the current trace.
+    """
+
+    def run(shard: list[str]) -> list[list[str]]:
+        response = function.remote(model_name, shard, **kwargs)
+        merge(response["trace"])
+        return response["completions"]
+
+    return run
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+
+from typing import TYPE_CHECKING
+
+from fim_eval.execution import PASSED, ExecutionPool
+from fim_eval.tracing import span
+
+if TYPE_CHECKING:
+    # Only for annotations: pydantic is slow to import for the CLI.
+    from fim_eval.load_problems import Problem
+
+# A completion gets `TIMEOUT_MULTIPLIER` times the slowest observed runtime of
+# the canonical solution, but never less than `TIMEOUT_FLOOR` seconds.
+TIMEOUT_MULTIPLIER = 10.0
+TIMEOUT_FLOOR = 1.0
+# Used for problems whose canonical solution did not pass during calibration.
+DEFAULT_TIMEOUT = 10.0
+
+CALIBRATION_TIMEOUT = 30.0
+CALIBRATION_ROUNDS = 3
+
+
+def calibration_path(dataset_path: str) -> str:
+    """data/HumanEval-SingleLineInfilling.jsonl.gz -> data/HumanEval-SingleLineInfilling.timings.json"""
+    return dataset_path.removesuffix(".gz").removesuffix(".jsonl") + ".timings.json"
+
+
+def calibrate(
+    problems: list["Problem"], pool: ExecutionPool, rounds: int = CALIBRATION_ROUNDS
+) -> dict[str, float]:
+    """
+    Runs every canonical solution through the pool `rounds` times and returns
+    the slowest passing runtime per task_id.
+    """
+    runtimes: dict[str, float] = {}
+    for _ in range(rounds):
+        futures = [
+            pool.submit(
+                problem.model_dump(), problem.canonical_solution, CALIBRATION_TIMEOUT
+            )
+            for problem in problems
+        ]
+        for future in futures:
+            result = future.result()
+            if result["status"] == PASSED:
+                task_id = result["task_id"]
+                runtimes[task_id] = max(runtimes.get(task_id, 0.0), result["elapsed"])
+    return runtimes
+
+
+def timeout_for(
+    runtime: float | None,
+    multiplier: float = TIMEOUT_MULTIPLIER,
+    floor: float = TIMEOUT_FLOOR,
+) -> float:
+    if runtime is None:
+        return DEFAULT_TIMEOUT
+    return max(floor, multiplier * runtime)
+
+
+def load_timeouts(
+    dataset_path: str,
+    problems: list["Problem"],
+    pool: ExecutionPool,
+    multiplier: float = TIMEOUT_MULTIPLIER,
+    floor: float = TIMEOUT_FLOOR,
+) -> dict[str, float]:
+    """
+    Returns a timeout per task_id. Canonical runtimes are cached next to the
+    dataset and recalibrated whenever the dataset file changes. Problems the
+    cache has not seen (e.g. after calibrating on a subset) are calibrated
+    and added.
+    """
+    path = calibration_path(dataset_path)
+    with open(dataset_path, "rb") as f:
+        dataset_sha256 = hashlib.file_digest(f, "sha256").hexdigest()
+
+    runtimes: dict[str, float] = {}
+    calibrated: set[str] = set()
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            cached = json.load(f)
+        if cached["dataset_sha256"] == dataset_sha256:
+            runtimes = cached["runtimes"]
+            calibrated = set(cached.get("calibrated", runtimes))
+
+    uncalibrated = [
+        problem for problem in problems if problem.task_id not in calibrated
+    ]
+    if uncalibrated:
+        print(f"Calibrating timeouts for {len(uncalibrated)} problems...")
+        with span("calibrate_timeouts", problems=len(uncalibrated)):
+            runtimes.update(calibrate(uncalibrated, pool))
+        calibrated.update(problem.task_id for problem in uncalibrated)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "dataset_sha256": dataset_sha256,
+                    "runtimes": runtimes,
+                    "calibrated": sorted(calibrated),
+                },
+                f,
+            )
+
+    return {
+        problem.task_id: timeout_for(runtimes.get(problem.task_id), multiplier, floor)
+        for problem in problems
+    }
@@ -0,0 +1,156 @@
+"""
+Named, nested spans over the pipeline stages, exported as Chrome trace event
+JSON (open it in https://ui.perfetto.dev or chrome://tracing):
+
+    with span("generation", prompts=len(prompts)) as s:
+        ...
+    timings["generation"] = s.seconds
+
+Spans nest by time on each thread. They are only recorded while the current
+tracer is enabled (`enable()`, or FIM_EVAL_TRACE=1), but always measure
+their duration so callers can keep reporting timings.
+
+Remote functions run under `recording(name)`, which collects their spans into
+a fresh tracer whose events they return alongside their output. The caller
+`merge`s them into its own trace, where each container shows up as its own
+process. Timestamps are wall-clock microseconds so remote spans line up with
+local ones, up to the clock skew between hosts.
+"""
+
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+
+class Span:
+    __slots__ = ("name", "args", "start", "seconds")
+
+    def __init__(self, name: str, args: dict):
+        self.name = name
+        self.args = args
+        self.start = time.time()
+        self.seconds = 0.0
+
+
+class Tracer:
+    def __init__(self, process_name: str = "local", enabled: bool = True):
+        self.process_name = process_name
+        self.enabled = enabled
+        self.pid = os.getpid()
+        self.events: list[dict] = []
+        self._lock = threading.Lock()
+        self._threads: set[int] = set()
+        self._pids = {self.pid}
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args) -> Iterator[Span]:
+        """Times the block and records it with `args`, which it may add to."""
+        s = Span(name, args)
+        t0 = time.perf_counter()
+        try:
+            yield s
+        finally:
+            s.seconds = time.perf_counter() - t0
+            if self.enabled:
+                self._record(s)
+
+    def _record(self, s: Span):
+        tid = threading.get_native_id()
+        event = {
+            "name": s.name,
+            "ph": "X",
+            "ts": s.start * 1e6,
+            "dur": s.seconds * 1e6,
+            "pid": self.pid,
+            "tid": tid,
+        }
+        if s.args:
+            event["args"] = s.args
+        with self._lock:
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self.events.append(
+                    metadata(
+                        "thread_name", self.pid, tid, threading.current_thread().name
+                    )
+                )
+            self.events.append(event)
+
+    def collect(self) -> list[dict]:
+        """The events recorded so far, with this process's name, for `merge`."""
+        with self._lock:
+            return [metadata("process_name", self.pid, 0, self.process_name)] + list(
+                self.events
+            )
+
+    def extend(self, events: list[dict]):
+        """
+        Adds events recorded in this process by another tracer, e.g. for work
+        done on a thread shared by several traces.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for event in events:
+                if event["ph"] == "M":
+                    if event["tid"] in self._threads:
+                        continue
+                    self._threads.add(event["tid"])
+                self.events.append(event)
+
+    def merge(self, events: Optional[list[dict]]):
+        """Adds events collected by another tracer, as their own processes."""
+        if not self.enabled or not events:
+            return
+        with self._lock:
+            pids: dict[int, int] = {}
+            for event in events:
+                if event["pid"] not in pids:
+                    pids[event["pid"]] = max(self._pids) + 1
+                    self._pids.add(pids[event["pid"]])
+                self.events.append({**event, "pid": pids[event["pid"]]})
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.collect(), "displayTimeUnit": "ms"}, f)
+
+
+def metadata(name: str, pid: int, tid: int, value: str) -> dict:
+    return {"name": name, "ph": "M", "pid": pid, "tid": tid, "args": {"name": value}}
+
+
+TRACER = Tracer(enabled=bool(os.environ.get("FIM_EVAL_TRACE")))
+_current: contextvars.ContextVar[Tracer] = contextvars.ContextVar(
+    "tracer", default=TRACER
+)
+
+
+def current() -> Tracer:
+    return _current.get()
+
+
+def enable():
+    TRACER.enabled = True
+
+
+def span(name: str, **args):
+    return current().span(name, **args)
+
+
+def merge(events: Optional[list[dict]]):
+    current().merge(events)
+
+
+@contextlib.contextmanager
+def recording(process_name: str) -> Iterator[Tracer]:
+    """Records this thread's spans into a fresh tracer, e.g. in a remote function."""
+    tracer = Tracer(process_name)
+    token = _current.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current.reset(token)
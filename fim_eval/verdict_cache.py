@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from fim_eval.execution import FAILED, HARNESS_VERSION, PASSED
+
+DEFAULT_PATH = os.path.join(os.getcwd(), "data", "verdict_cache.sqlite")
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Eviction trims the store to this fraction of max_bytes so it does not run on
+# every insert once the cache is full.
+EVICTION_TARGET = 0.9
+
+# Only verdicts that depend on nothing but the code are cached. Timeouts and
+# crashes depend on load and the host, so those are always re-run.
+CACHEABLE_STATUSES = (PASSED, FAILED)
+VERDICT_FIELDS = (
+    "passed",
+    "result",
+    "status",
+    "exception_type",
+    "message",
+    "elapsed",
+    "user_time",
+    "system_time",
+    "max_rss",
+)
+
+
+def problem_digest(problem: Dict) -> str:
+    fields = [problem[key] for key in ("prompt", "suffix", "test", "entry_point")]
+    return hashlib.sha256(json.dumps(fields).encode()).hexdigest()
+
+
+def completion_digest(completion: str) -> str:
+    return hashlib.sha256(completion.encode()).hexdigest()
+
+
+class VerdictCache:
+    """
+    On-disk store of check_correctness verdicts keyed by the problem, the
+    completion and HARNESS_VERSION, evicting least recently used entries once
+    it grows past `max_bytes`. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            " key TEXT PRIMARY KEY,"
+            " verdict TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)"
+        )
+        (self._size,) = self._db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM verdicts"
+        ).fetchone()
+
+    @staticmethod
+    def key(problem: Dict, completion: str) -> str:
+        return (
+            f"{HARNESS_VERSION}:{problem_digest(problem)}:"
+            f"{completion_digest(completion)}"
+        )
+
+    def get(self, problem: Dict, completion: str) -> Optional[Dict]:
+        """Returns the cached verdict fields, or None on a miss."""
+        key = self.key(problem, completion)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT verdict FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute(
+                "UPDATE verdicts SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._db.commit()
+        return json.loads(row[0])
+
+    def put(self, problem: Dict, completion: str, result: Dict):
+        if result["status"] not in CACHEABLE_STATUSES:
+            return
+        key = self.key(problem, completion)
+        verdict = json.dumps({field: result[field] for field in VERDICT_FIELDS})
+        size = len(key) + len(verdict)
+        with self._lock:
+            previous = self._db.execute(
+                "SELECT size FROM verdicts WHERE key = ?", (key,)
+            ).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                (key, verdict, size, time.time()),
+            )
+            self._size += size - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def _evict(self):
+        target = self.max_bytes * EVICTION_TARGET
+        rows = self._db.execute("SELECT key, size FROM verdicts ORDER BY last_used")
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._db.executemany("DELETE FROM verdicts WHERE key = ?", evicted)
+        self.evictions += len(evicted)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=self.hits / lookups if lookups else 0.0,
+            evictions=self.evictions,
+            size_bytes=self._size,
+        )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> "VerdictCache":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
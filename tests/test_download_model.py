@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from fim_eval.download_model import LocalDirSource, read_manifest, sync_model
+
+MODEL = "org/model"
+
+
+class RecordingSource(LocalDirSource):
+    """LocalDirSource that remembers which paths each sync fetched."""
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.fetched: list[str] = []
+
+    def fetch(self, model_name: str, revision: str, paths: list[str], local_dir: str):
+        self.fetched.extend(paths)
+        super().fetch(model_name, revision, paths, local_dir)
+
+
+def write(root, path: str, content: str):
+    full_path = os.path.join(root, MODEL, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, "w") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def hub(tmp_path):
+    root = tmp_path / "hub"
+    write(root, "config.json", "{}")
+    write(root, "tokenizer.json", '{"vocab": []}')
+    write(root, "model-00001.safetensors", "weights 1")
+    write(root, "model-00002.safetensors", "weights 2")
+    return root
+
+
+@pytest.fixture
+def models_dir(tmp_path):
+    return str(tmp_path / "models")
+
+
+def synced_files(models_dir: str) -> set[str]:
+    return set(read_manifest(os.path.join(models_dir, MODEL))["files"])
+
+
+def test_first_sync_fetches_everything(hub, models_dir):
+    source = RecordingSource(str(hub))
+
+    assert sync_model(MODEL, models_dir, source)
+    assert sorted(source.fetched) == [
+        "config.json",
+        "model-00001.safetensors",
+        "model-00002.safetensors",
+        "tokenizer.json",
+    ]
+    with open(os.path.join(models_dir, MODEL, "model-00002.safetensors")) as f:
+        assert f.read() == "weights 2"
+
+
+def test_unchanged_source_is_a_no_op(hub, models_dir):
+    sync_model(MODEL, models_dir, LocalDirSource(str(hub)))
+    source = RecordingSource(str(hub))
+
+    assert not sync_model(MODEL, models_dir, source)
+    assert source.fetched == []
+
+
+def test_only_the_changed_file_is_fetched(hub, models_dir):
+    sync_model(MODEL, models_dir, LocalDirSource(str(hub)))
+    write(hub, "model-00002.safetensors", "retrained weights 2")
+    source = RecordingSource(str(hub))
+
+    assert sync_model(MODEL, models_dir, source)
+    assert source.fetched == ["model-00002.safetensors"]
+    with open(os.path.join(models_dir, MODEL, "model-00002.safetensors")) as f:
+        assert f.read() == "retrained weights 2"
+
+
+def test_file_missing_on_disk_is_fetched_again(hub, models_dir):
+    sync_model(MODEL, models_dir, LocalDirSource(str(hub)))
+    os.remove(os.path.join(models_dir, MODEL, "config.json"))
+    source = RecordingSource(str(hub))
+
+    assert sync_model(MODEL, models_dir, source)
+    assert source.fetched == ["config.json"]
+
+
+def test_file_removed_from_source_is_removed(hub, models_dir):
+    sync_model(MODEL, models_dir, LocalDirSource(str(hub)))
+    os.remove(os.path.join(hub, MODEL, "tokenizer.json"))
+    source = RecordingSource(str(hub))
+
+    assert sync_model(MODEL, models_dir, source)
+    assert source.fetched == []
+    assert not os.path.exists(os.path.join(models_dir, MODEL, "tokenizer.json"))
+    assert "tokenizer.json" not in synced_files(models_dir)
+
+
+def test_bin_weights_are_skipped_when_safetensors_exist(hub, models_dir):
+    write(hub, "pytorch_model.bin", "pickled weights")
+    source = RecordingSource(str(hub))
+
+    sync_model(MODEL, models_dir, source)
+    assert "pytorch_model.bin" not in source.fetched
+    assert "pytorch_model.bin" not in synced_files(models_dir)
+    assert not os.path.exists(os.path.join(models_dir, MODEL, "pytorch_model.bin"))
+
+
+def test_bin_weights_are_fetched_without_safetensors(tmp_path, models_dir):
+    root = tmp_path / "hub"
+    write(root, "config.json", "{}")
+    write(root, "pytorch_model.bin", "pickled weights")
+    source = RecordingSource(str(root))
+
+    sync_model(MODEL, models_dir, source)
+    assert sorted(source.fetched) == ["config.json", "pytorch_model.bin"]
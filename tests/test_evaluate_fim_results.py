@@ -0,0 +1,47 @@
+import json
+
+from fim_eval.evaluate_fim_results import print_failures, verdicts_path
+from fim_eval.load_problems import Problem
+
+
+def write_lines(path, rows):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def test_failures_use_the_latest_verdict(tmp_path, capsys):
+    results_path = str(tmp_path / "results.jsonl")
+    write_lines(
+        results_path,
+        [
+            {"task_id": "T/0", "completion": "    return 1\n"},
+            {"task_id": "T/1", "completion": "    return 2\n"},
+        ],
+    )
+    write_lines(
+        verdicts_path(results_path),
+        [
+            {"task_id": "T/0", "completion_id": 0, "passed": False},
+            {"task_id": "T/1", "completion_id": 1, "passed": True},
+            # Re-evaluated, e.g. with a longer timeout.
+            {"task_id": "T/0", "completion_id": 0, "passed": True},
+            {"task_id": "T/1", "completion_id": 1, "passed": False},
+        ],
+    )
+    problem_by_id = {
+        task_id: Problem(
+            task_id=task_id,
+            prompt="def f():\n",
+            suffix="\n",
+            canonical_solution="",
+            test="",
+            entry_point="f",
+        )
+        for task_id in ("T/0", "T/1")
+    }
+
+    print_failures(results_path, problem_by_id, limit=10)
+    out = capsys.readouterr().out
+    assert "task id failed: T/1" in out
+    assert "T/0" not in out
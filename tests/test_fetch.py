@@ -0,0 +1,162 @@
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fim_eval import fetch as fetch_module
+from fim_eval.fetch import ChecksumMismatch, DatasetSource, fetch, read_pins
+
+CONTENT = bytes(range(256)) * 40
+DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `server.content`, honouring single byte ranges if `server.ranged`."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_content(self, with_body: bool):
+        content = self.server.content
+        self.server.requests.append(self.headers.get("Range"))
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range") or "")
+        if match and self.server.ranged:
+            start = int(match[1])
+            end = int(match[2]) + 1 if match[2] else len(content)
+            if start >= len(content):
+                self.send_response(416)
+                self.end_headers()
+                return
+            body = content[start:end]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(content)}")
+        else:
+            body = content
+            self.send_response(200)
+        if self.server.ranged:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.send_content(with_body=False)
+
+    def do_GET(self):
+        self.send_content(with_body=True)
+
+
+@pytest.fixture(params=[True, False], ids=["ranged", "unranged"])
+def server(request):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    server.content = CONTENT
+    server.ranged = request.param
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(fetch_module, "CHUNK_SIZE", 1000)
+
+
+def source(server, sha256=None) -> DatasetSource:
+    url = f"http://127.0.0.1:{server.server_address[1]}/data.jsonl.gz"
+    return DatasetSource("data.jsonl.gz", url, sha256)
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_is_verified_and_cached(server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+
+    path = fetch(source(server, DIGEST), str(tmp_path / "a"), cache_dir)
+    assert read(path) == CONTENT
+    if server.ranged:
+        assert len(server.requests) == 1 + 11  # The probe, then every chunk.
+
+    server.requests.clear()
+    path = fetch(source(server, DIGEST), str(tmp_path / "b"), cache_dir)
+    assert read(path) == CONTENT
+    assert server.requests == []
+
+
+def test_first_download_pins_the_source(server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+
+    fetch(source(server), str(tmp_path / "a"), cache_dir)
+    assert read_pins(cache_dir) == {source(server).url: DIGEST}
+
+    os.remove(fetch_module.blob_path(cache_dir, DIGEST))
+    server.content = b"changed upstream"
+    with pytest.raises(ChecksumMismatch):
+        fetch(source(server), str(tmp_path / "b"), cache_dir)
+
+
+def test_mismatched_download_is_rejected(server, tmp_path):
+    with pytest.raises(ChecksumMismatch):
+        fetch(source(server, "0" * 64), str(tmp_path), str(tmp_path / "cache"))
+    assert not os.path.exists(tmp_path / "data.jsonl.gz")
+
+
+def test_interrupted_chunked_download_resumes(server, tmp_path):
+    if not server.ranged:
+        pytest.skip("resuming chunks needs range requests")
+    cache_dir = str(tmp_path / "cache")
+    downloads = os.path.join(cache_dir, "downloads")
+    os.makedirs(downloads)
+    part_path = os.path.join(
+        downloads, hashlib.sha256(source(server).url.encode()).hexdigest() + ".part"
+    )
+    with open(part_path, "wb") as f:
+        f.write(CONTENT[:3000] + bytes(len(CONTENT) - 3000))
+    with open(part_path + ".chunks.json", "w") as f:
+        f.write("[0, 1, 2]")
+
+    path = fetch(source(server, DIGEST), str(tmp_path), cache_dir)
+    assert read(path) == CONTENT
+    assert len(server.requests) == 1 + 8
+
+
+def test_existing_file_without_a_digest_is_not_adopted(server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    with open(tmp_path / "data.jsonl.gz", "wb") as f:
+        f.write(b"a local fixture")
+
+    path = fetch(source(server), str(tmp_path), cache_dir)
+    assert read(path) == CONTENT
+    assert read_pins(cache_dir) == {source(server).url: DIGEST}
+
+
+def test_existing_file_matching_the_digest_is_adopted(server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    with open(tmp_path / "data.jsonl.gz", "wb") as f:
+        f.write(CONTENT)
+
+    fetch(source(server, DIGEST), str(tmp_path), cache_dir)
+    assert server.requests == []
+    assert read(fetch_module.blob_path(cache_dir, DIGEST)) == CONTENT
+
+
+def test_editing_a_placed_file_leaves_the_cache_intact(server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    path = fetch(source(server, DIGEST), str(tmp_path / "a"), cache_dir)
+    with open(path, "r+b") as f:
+        f.write(b"edited")
+
+    assert read(fetch_module.blob_path(cache_dir, DIGEST)) == CONTENT
+    server.requests.clear()
+    path = fetch(source(server, DIGEST), str(tmp_path / "a"), cache_dir)
+    assert read(path) == CONTENT
+    assert server.requests == []
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from fim_eval.model_server import RequestBatcher
+from fim_eval.tracing import recording, span
+
+
+def echo_batch(prompts: list[str], params: list) -> list:
+    with span("generation", prompts=len(prompts)):
+        return [prompt.upper() for prompt in prompts]
+
+
+def submit_traced(batcher: RequestBatcher, prompts: list[str], results: dict):
+    with recording("model_server") as tracer, span("generate_request"):
+        results[prompts[0]] = batcher.submit(prompts, [None] * len(prompts))
+    results[prompts[0] + " trace"] = tracer.collect()
+
+
+def span_names(events: list[dict]) -> list[str]:
+    return sorted(event["name"] for event in events if event["ph"] == "X")
+
+
+def test_batch_spans_join_every_request_trace():
+    batcher = RequestBatcher(echo_batch, window=0.2)
+    results: dict = {}
+    threads = [
+        threading.Thread(target=submit_traced, args=(batcher, prompts, results))
+        for prompts in (["a", "b"], ["c"])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results["a"] == ["A", "B"]
+    assert results["c"] == ["C"]
+    for prompt in ("a", "c"):
+        events = results[prompt + " trace"]
+        assert span_names(events) == ["batch", "generate_request", "generation"]
+        (batch,) = [event for event in events if event["name"] == "batch"]
+        assert batch["args"] == {"requests": 2, "prompts": 3}
+
+
+def test_batch_errors_reach_every_request():
+    def fail(prompts, params):
+        raise RuntimeError("out of memory")
+
+    batcher = RequestBatcher(fail, window=0.0)
+    with recording("model_server") as tracer, pytest.raises(RuntimeError):
+        batcher.submit(["a"], [None])
+    assert span_names(tracer.collect()) == ["batch"]
@@ -0,0 +1,33 @@
+import math
+
+import numpy as np
+import pytest
+
+from fim_eval.pass_at_k import pass_at_k, summarize_pass_at_k
+
+
+def reference(n: int, c: int, k: int) -> float:
+    return 1.0 - math.comb(n - c, k) / math.comb(n, k)
+
+
+@pytest.mark.parametrize("n, c", [(1, 0), (1, 1), (5, 0), (5, 2), (10, 9), (20, 3)])
+def test_matches_the_combinatorial_formula(n, c):
+    ks = [k for k in (1, 3, 5, 10) if k <= n]
+
+    estimates = pass_at_k(n, [c], ks)[:, 0]
+    assert estimates == pytest.approx([reference(n, c, k) for k in ks])
+
+
+def test_k_above_the_sample_count_is_undefined():
+    estimates = pass_at_k([1, 5], [1, 0], [1, 3])
+
+    assert estimates[:, 1] == pytest.approx([0.0, 0.0])
+    assert estimates[0, 0] == 1.0
+    assert np.isnan(estimates[1, 0])
+
+
+def test_summary_skips_k_above_the_fewest_samples():
+    summary = summarize_pass_at_k([1, 1, 1], [1, 0, 0], [1, 3, 5])
+
+    assert [result.k for result in summary] == [1]
+    assert summary[0].estimate == pytest.approx(1 / 3)
@@ -0,0 +1,67 @@
+import pytest
+
+from fim_eval.profiles import (
+    MULTI_LINE,
+    RANDOM_SPAN,
+    SINGLE_LINE,
+    stop_sequences,
+    truncate_completion,
+)
+
+
+@pytest.mark.parametrize(
+    "completion, expected",
+    [
+        ("    return x\n", "    return x\n"),
+        ("    return x\n    return y\n", "    return x\n"),
+        ("    return x", "    return x\n"),
+    ],
+)
+def test_single_line_keeps_the_first_line(completion, expected):
+    assert truncate_completion(completion, "\n    pass\n", SINGLE_LINE) == expected
+
+
+def test_multi_line_stops_where_the_suffix_is_written_back():
+    suffix = "    return total\n"
+    completion = "    total = sum(xs)\n    return total\n\ndef g():\n"
+
+    assert truncate_completion(completion, suffix, MULTI_LINE) == (
+        "    total = sum(xs)\n"
+    )
+
+
+def test_multi_line_completion_opening_with_the_suffix_is_empty():
+    suffix = "    return total\n"
+
+    assert truncate_completion("    return total\n", suffix, MULTI_LINE) == ""
+
+
+def test_multi_line_does_not_stop_at_a_mid_line_match():
+    suffix = "    return total\n"
+    completion = "    x = 1  # return total\n"
+
+    assert truncate_completion(completion, suffix, MULTI_LINE) == completion
+
+
+def test_multi_line_stop_sequence_is_the_suffix_line():
+    stops = stop_sequences((), True, "\n    return total\n")
+
+    assert stops == ["\n    return total"]
+
+
+def test_random_span_keeps_a_completion_ending_like_the_suffix():
+    assert truncate_completion("set(l)", ")\n", RANDOM_SPAN) == "set(l)"
+
+
+def test_random_span_stops_where_the_suffix_is_written_back():
+    suffix = ")\n    return result\n"
+    completion = "set(l))\n    return result\n"
+
+    assert truncate_completion(completion, suffix, RANDOM_SPAN) == "set(l)"
+
+
+def test_random_span_may_cross_lines():
+    suffix = "\n    return y\n"
+    completion = "1\n    y = x + 1\n    return y\n"
+
+    assert truncate_completion(completion, suffix, RANDOM_SPAN) == ("1\n    y = x + 1")
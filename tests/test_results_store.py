@@ -0,0 +1,103 @@
+import glob
+import json
+import os
+
+import pytest
+
+from fim_eval import results_store
+from fim_eval.records import ResultRecord
+from fim_eval.results_store import ResultsStore
+
+RUN = "run"
+
+
+@pytest.fixture(params=[False, True], ids=["plain", "compressed"])
+def store(request, tmp_path):
+    with ResultsStore(str(tmp_path / "store"), compress=request.param) as store:
+        yield store
+
+
+def write_results(path, rows: list[dict]):
+    with open(path, "w") as f:
+        for row in rows:
+            f.write(json.dumps(row) + "\n")
+
+
+def segments(store: ResultsStore, run_id: str = RUN) -> list[str]:
+    return sorted(glob.glob(os.path.join(store.root, "segments", run_id, "*.seg")))
+
+
+def completions(store: ResultsStore, run_id: str = RUN) -> list[tuple[str, str, int]]:
+    return [
+        (result.task_id, result.completion, result.sample_index)
+        for _, result in store.scan(run_id)
+    ]
+
+
+def test_each_append_rolls_over_to_a_new_segment(store):
+    store.append(RUN, [ResultRecord("T/0", "a", 0), ResultRecord("T/0", "b", 1)])
+    store.append(RUN, [ResultRecord("T/1", "c", 0)])
+
+    assert len(segments(store)) == 2
+    assert completions(store) == [("T/0", "a", 0), ("T/0", "b", 1), ("T/1", "c", 0)]
+
+
+def test_appending_a_sample_again_repoints_the_index(store):
+    store.append(RUN, [ResultRecord("T/0", "old", 0)])
+    store.append(RUN, [ResultRecord("T/0", "new", 0)])
+
+    assert store.get(RUN, "T/0", 0).completion == "new"
+    assert len(segments(store)) == 2
+
+
+def test_parallel_ingest_writes_a_segment_per_range(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(results_store, "MIN_INGEST_CHUNK_BYTES", 64)
+    rows = [{"task_id": f"T/{i // 3}", "completion": f"c{i}"} for i in range(30)]
+    write_results(tmp_path / "results.jsonl", rows)
+
+    assert store.ingest(RUN, str(tmp_path / "results.jsonl"), workers=3) == 30
+    assert len(segments(store)) == 3
+    assert completions(store) == [
+        (row["task_id"], row["completion"], i % 3) for i, row in enumerate(rows)
+    ]
+
+
+def test_index_survives_a_torn_segment_tail(store, tmp_path):
+    store.append(RUN, [ResultRecord("T/0", "a", 0), ResultRecord("T/1", "b", 0)])
+    # A writer killed mid-segment leaves bytes the index never pointed at.
+    with open(segments(store)[0], "ab") as f:
+        f.write(b'{"task_id": "T/2", "compl')
+    store.close()
+
+    with ResultsStore(store.root) as reopened:
+        assert completions(reopened) == [("T/0", "a", 0), ("T/1", "b", 0)]
+        reopened.append(RUN, [ResultRecord("T/2", "c", 0)])
+        assert len(segments(reopened)) == 2
+        assert reopened.get(RUN, "T/2", 0).completion == "c"
+
+
+def test_rejected_ingest_leaves_the_run_as_it_was(store, tmp_path):
+    store.append(RUN, [ResultRecord("T/0", "a", 0)])
+    write_results(
+        tmp_path / "results.jsonl",
+        [
+            {"task_id": "T/0", "completion": "x", "sample_index": 0},
+            {"task_id": "T/0", "completion": "y", "sample_index": 0},
+        ],
+    )
+
+    with pytest.raises(ValueError):
+        store.ingest(RUN, str(tmp_path / "results.jsonl"))
+    assert len(segments(store)) == 1
+    assert completions(store) == [("T/0", "a", 0)]
+
+
+def test_ingest_replaces_the_run_without_rewriting_segments(store, tmp_path):
+    store.append(RUN, [ResultRecord("T/0", "a", 0), ResultRecord("T/1", "b", 0)])
+    write_results(tmp_path / "results.jsonl", [{"task_id": "T/1", "completion": "c"}])
+
+    assert store.ingest(RUN, str(tmp_path / "results.jsonl")) == 1
+    assert completions(store) == [("T/1", "c", 0)]
+    # Superseded records stay on disk; there is no compaction.
+    assert len(segments(store)) == 2
+    assert store.runs() == {RUN: {"unevaluated": 1}}
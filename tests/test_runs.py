@@ -0,0 +1,92 @@
+import glob
+import os
+
+import pytest
+
+from fim_eval.backends import ModalFunctionBackend, SamplingConfig
+from fim_eval.load_problems import Problem
+from fim_eval.runs import assemble_results, run_generation
+
+
+class FakeFunction:
+    """Stands in for a Modal generation function; fails once `calls_left` is 0."""
+
+    def __init__(self, calls_left: int = -1):
+        self.calls_left = calls_left
+        self.shard_sizes: list[int] = []
+
+    def remote(self, model_name: str, prompts: list[str], samples_per_prompt=1, **kw):
+        if self.calls_left == 0:
+            raise RuntimeError("container timed out")
+        self.calls_left -= 1
+        self.shard_sizes.append(len(prompts))
+        completions = [["pass"] * samples_per_prompt for _ in prompts]
+        return {"completions": completions, "trace": []}
+
+
+class FakeModalBackend(ModalFunctionBackend):
+    name = "fake-modal"
+
+    def __init__(self, function: FakeFunction, num_shards: int = 1):
+        super().__init__("model", num_shards)
+        self._function = function
+
+    def function(self):
+        return self._function
+
+
+@pytest.fixture
+def problems():
+    return [
+        Problem(
+            task_id=f"Test/{i}",
+            prompt=f"def f{i}():\n",
+            suffix="\n",
+            canonical_solution="    pass",
+            test="",
+            entry_point=f"f{i}",
+        )
+        for i in range(10)
+    ]
+
+
+def shard_files(run_dir) -> list[str]:
+    return sorted(glob.glob(os.path.join(run_dir, "shard-*.results")))
+
+
+def test_modal_generation_is_checkpointed_per_shard(tmp_path, problems):
+    function = FakeFunction()
+    config = SamplingConfig(samples_per_prompt=2)
+
+    run_generation(
+        str(tmp_path), problems, FakeModalBackend(function), config, "model", None, 4
+    )
+    assert sorted(function.shard_sizes) == [3, 3, 4]
+    assert len(shard_files(tmp_path)) == 3
+    results = assemble_results(str(tmp_path), problems, 2, str(tmp_path / "out"))
+    assert len(results) == 20
+
+
+def test_interrupted_run_keeps_finished_shards(tmp_path, problems):
+    config = SamplingConfig(samples_per_prompt=1)
+
+    with pytest.raises(RuntimeError):
+        run_generation(
+            str(tmp_path),
+            problems,
+            FakeModalBackend(FakeFunction(calls_left=2)),
+            config,
+            "model",
+            None,
+            4,
+        )
+    assert len(shard_files(tmp_path)) == 2
+
+    function = FakeFunction()
+    timings = run_generation(
+        str(tmp_path), problems, FakeModalBackend(function), config, "model", None, 4
+    )
+    assert timings["generated_samples"] == sum(function.shard_sizes) < len(problems)
+    assert (
+        len(assemble_results(str(tmp_path), problems, 1, str(tmp_path / "out"))) == 10
+    )